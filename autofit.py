@@ -0,0 +1,311 @@
+import argparse
+import sys
+import time
+import cv2
+import numpy as np
+from distortion import DistortionCoefficients
+from distortion_models import get_camera_matrix
+from lens_model import undistort_points
+
+# Checkerboard inner corner counts tried when the pattern size is not given
+PATTERN_SIZES = ((9, 6), (8, 6), (7, 7), (7, 6), (7, 5), (6, 5), (6, 4), (5, 4), (10, 7), (11, 8))
+
+# Coefficients in slider order, the solver works in slider units so all parameters have similar scales
+PARAMETERS = ('k1', 'k2', 'k3', 'p1', 'p2')
+
+# Short edge pieces only constrain the dominant radial term reliably
+EDGE_PARAMETERS = ('k1',)
+
+# A board that does not reach the image corners cannot tell k3 from k1 and k2. Starting from k1, k2 and then p1/p2
+# are only kept when they make the lines clearly straighter, otherwise they bend the corners of the image
+# while fitting noise on the board.
+CHECKERBOARD_STEPS = (('k1',), ('k2',), ('p1', 'p2'))
+MIN_RMS_IMPROVEMENT = 0.1
+
+# The pattern sizes are searched on a copy this small, one search at the working size can take half a second
+PATTERN_SEARCH_SIZE = 320
+
+SLIDER_RANGE = 500
+
+
+class FitResult:
+    def __init__(self, slider_values, rms, groups, method, elapsed):
+        self.slider_values = slider_values
+        self.rms = rms
+        self.groups = groups
+        self.method = method
+        self.elapsed = elapsed
+
+    def __str__(self):
+        return '{} ({} lines from {}, rms {:.3f} px, {:.0f} ms)'.format(
+            ' / '.join('{} = {}'.format(name, value) for name, value in zip(PARAMETERS, self.slider_values)),
+            self.groups, self.method, self.rms, self.elapsed * 1000.0)
+
+
+def downsample(img, max_size):
+    height, width = img.shape[:2]
+    scale = min(max_size / max(width, height), 1.0)
+    if scale < 1.0:
+        img = cv2.resize(img, (max(1, int(round(width * scale))), max(1, int(round(height * scale)))),
+                         interpolation=cv2.INTER_AREA)
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+    return gray, gray.shape[1] / width
+
+
+def detect_checkerboard(gray, pattern_size=None):
+    flags = cv2.CALIB_CB_ADAPTIVE_THRESH | cv2.CALIB_CB_NORMALIZE_IMAGE | cv2.CALIB_CB_FAST_CHECK
+    window = 5
+    if pattern_size is None:
+        # Pattern sizes are tried on a small copy, the corners found there are refined at the working size
+        small, small_scale = downsample(gray, PATTERN_SEARCH_SIZE)
+        for cols, rows in PATTERN_SIZES:
+            found, corners = cv2.findChessboardCorners(small, (cols, rows), flags=flags)
+            if found:
+                corners = (corners + 0.5) / small_scale - 0.5
+                window = max(window, int(round(2.0 / small_scale)))
+                break
+        else:
+            return []
+    else:
+        cols, rows = pattern_size
+        found, corners = cv2.findChessboardCorners(gray, (cols, rows), flags=flags)
+        if not found:
+            return []
+    corners = cv2.cornerSubPix(gray, corners.astype(np.float32), (window, window), (-1, -1),
+                               (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.01))
+    grid = corners.reshape(rows, cols, 2).astype(np.float64)
+    # Every row and every column of corners lies on a straight line
+    return [grid[r] for r in range(rows)] + [grid[:, c] for c in range(cols)]
+
+
+def detect_lines(gray, min_length=0.06, max_points=64):
+    # Edge curves are split at their corners, the long and nearly straight pieces are taken as lines
+    height, width = gray.shape[:2]
+    edges = cv2.Canny(cv2.GaussianBlur(gray, (5, 5), 0), 50, 150)
+    contours, _ = cv2.findContours(edges, cv2.RETR_LIST, cv2.CHAIN_APPROX_NONE)
+    min_points = min_length * max(width, height)
+    epsilon = 0.01 * max(width, height)
+
+    groups = []
+    for contour in contours:
+        if len(contour) < min_points:
+            continue
+        # Corner indices of the polygon approximation, the curve between two corners is one line candidate
+        approx = cv2.approxPolyDP(contour, epsilon, True).reshape(-1, 2)
+        points = contour.reshape(-1, 2)
+        corners = np.flatnonzero((points[:, np.newaxis, :] == approx[np.newaxis, :, :]).all(axis=2).any(axis=1))
+        for start, end in zip(corners, np.append(corners[1:], corners[0] + len(points))):
+            piece = np.take(points, np.arange(start, end + 1), axis=0, mode='wrap').astype(np.float64)
+            if len(piece) < min_points:
+                continue
+            centered = piece - piece.mean(axis=0)
+            eigenvalues = np.linalg.eigvalsh(centered.T @ centered / len(piece))
+            # Reject blobs and strongly curved pieces
+            if eigenvalues[0] > 0.01 * eigenvalues[1]:
+                continue
+            # Averaging neighbouring contour pixels removes most of the integer quantization
+            kernel = np.ones(5) / 5.0
+            piece = np.stack([np.convolve(piece[:, i], kernel, mode='valid') for i in range(2)], axis=1)
+            step = max(1, len(piece) // max_points)
+            groups.append(piece[::step])
+    return groups
+
+
+def stack_groups(groups):
+    # All line points in one array plus the line index of every point, so lines are fitted in one pass
+    points = np.concatenate(groups)
+    labels = np.repeat(np.arange(len(groups)), [len(g) for g in groups])
+    return points, labels
+
+
+def fit_lines(points, labels):
+    # Principal direction of each group from its 2x2 covariance
+    counts = np.bincount(labels).astype(np.float64)
+    mean_x = np.bincount(labels, points[:, 0]) / counts
+    mean_y = np.bincount(labels, points[:, 1]) / counts
+    cx = points[:, 0] - mean_x[labels]
+    cy = points[:, 1] - mean_y[labels]
+    sxx = np.bincount(labels, cx * cx) / counts
+    syy = np.bincount(labels, cy * cy) / counts
+    sxy = np.bincount(labels, cx * cy) / counts
+    theta = 0.5 * np.arctan2(2.0 * sxy, sxx - syy)
+    major = 0.5 * (sxx + syy) + np.sqrt(0.25 * (sxx - syy) ** 2 + sxy ** 2)
+    return cx, cy, np.stack((np.cos(theta), np.sin(theta)), axis=1), major
+
+
+def straightness_residuals(points, labels, camera_matrix, dist_coeff, reference_directions, normalize=True,
+                           model=None):
+    # Distances of the undistorted points from the best fitting line of each group, the NumPy standard model
+    # unless another distortion model is given
+    if model is None:
+        undistorted = undistort_points(points, camera_matrix, dist_coeff)
+    else:
+        undistorted = model.undistort_points(points, camera_matrix, dist_coeff)
+    cx, cy, directions, major = fit_lines(undistorted, labels)
+
+    # Keep the normal orientation stable between evaluations so the Jacobian is continuous
+    if reference_directions is not None:
+        flip = np.where(np.sum(directions * reference_directions, axis=1) < 0, -1.0, 1.0)
+        directions = directions * flip[:, np.newaxis]
+    distances = cx * -directions[labels, 1] + cy * directions[labels, 0]
+
+    # Relative to the line length, otherwise shrinking the whole image would look like a better fit
+    if normalize:
+        distances = distances / np.sqrt(np.maximum(major, 1e-12))[labels]
+    return distances
+
+
+def levenberg_marquardt(residual_fn, x0, lower, upper, iterations=50, delta=0.5, tolerance=1e-9):
+    x = np.clip(np.asarray(x0, dtype=np.float64), lower, upper)
+    r = residual_fn(x)
+    cost = r @ r
+    damping = 1e-3
+    for _ in range(iterations):
+        # Forward difference Jacobian, one residual evaluation per parameter
+        jacobian = np.empty((len(r), len(x)))
+        for i in range(len(x)):
+            step = np.zeros_like(x)
+            step[i] = delta
+            jacobian[:, i] = (residual_fn(x + step) - r) / delta
+        a = jacobian.T @ jacobian
+        g = jacobian.T @ r
+
+        while True:
+            dx = np.linalg.solve(a + damping * np.diag(np.diag(a) + 1e-12), -g)
+            x_new = np.clip(x + dx, lower, upper)
+            r_new = residual_fn(x_new)
+            cost_new = r_new @ r_new
+            if np.isfinite(cost_new) and cost_new < cost:
+                break
+            damping *= 4.0
+            if damping > 1e8:
+                return x, cost
+
+        improvement = (cost - cost_new) / max(cost, 1e-30)
+        x, r, cost = x_new, r_new, cost_new
+        damping = max(damping / 3.0, 1e-9)
+        if improvement < tolerance or np.max(np.abs(dx)) < 1e-3:
+            break
+    return x, cost
+
+
+def fit_coefficients(img, focal_length=10.0, dist_coeff=None, parameters=None, pattern_size=None,
+                     max_size=800):
+    # None when no checkerboard or lines are found, ValueError when k1 needs more than the slider range
+    start = time.perf_counter()
+    dist_coeff = dist_coeff if dist_coeff is not None else DistortionCoefficients()
+    steps = np.array([getattr(dist_coeff, 'step_' + name) for name in PARAMETERS])
+
+    # Work on a downsampled copy, the scaled camera matrix keeps the coefficients unchanged
+    gray, scale = downsample(img, max_size)
+    height, width = gray.shape[:2]
+    camera_matrix = get_camera_matrix(width, height, focal_length, scale)
+
+    groups = detect_checkerboard(gray, pattern_size)
+    method = 'checkerboard'
+    if not groups:
+        groups = detect_lines(gray)
+        method = 'edges'
+    if not groups:
+        return None
+    if parameters is not None:
+        fit_steps = (tuple(parameters),)
+    elif method == 'checkerboard':
+        fit_steps = CHECKERBOARD_STEPS
+    else:
+        fit_steps = (EDGE_PARAMETERS,)
+
+    def to_coefficients(values):
+        # OpenCV order: k1, k2, p1, p2, k3
+        return (values * steps)[[0, 1, 3, 4, 2]]
+
+    def solve(names, values, points, labels):
+        active = np.array([name in names for name in PARAMETERS])
+        reference_directions = fit_lines(points, labels)[2]
+
+        def residual_fn(x):
+            trial = values.copy()
+            trial[active] = x
+            return straightness_residuals(points, labels, camera_matrix, to_coefficients(trial),
+                                          reference_directions)
+
+        x, _ = levenberg_marquardt(residual_fn, values[active], -SLIDER_RANGE, SLIDER_RANGE)
+        values = values.copy()
+        values[active] = x
+        # Parameters ending on the slider range limit are not fitted, the solver only ran out of room
+        at_limit = [name for name, value in zip(PARAMETERS, values) if name in names
+                    and abs(value) >= SLIDER_RANGE - 0.5]
+        return values, reference_directions, at_limit
+
+    def get_rms(values, points, labels, reference_directions):
+        # Remaining deviation from straight lines in full resolution pixels
+        distances = straightness_residuals(points, labels, camera_matrix, to_coefficients(values),
+                                           reference_directions, normalize=False)
+        return float(np.sqrt(np.mean(distances ** 2))) / scale
+
+    start_values = np.array([getattr(dist_coeff, name) for name in PARAMETERS]) / steps
+    names = [name for name in fit_steps[0]]
+    points, labels = stack_groups(groups)
+    values, reference_directions, at_limit = solve(names, start_values, points, labels)
+
+    # Drop lines that are still far from straight (curved objects, clutter) and fit again
+    distances = straightness_residuals(points, labels, camera_matrix, to_coefficients(values), reference_directions)
+    group_rms = np.sqrt(np.bincount(labels, distances ** 2) / np.bincount(labels))
+    inliers = group_rms <= max(3.0 * np.median(group_rms), 1e-3)
+    if not inliers.all():
+        groups = [g for g, keep in zip(groups, inliers) if keep]
+        points, labels = stack_groups(groups)
+        values, reference_directions, at_limit = solve(names, values, points, labels)
+
+    # Explicitly requested parameters that hit the limit are left at their start value and the rest refitted
+    while at_limit:
+        names = [name for name in names if name not in at_limit]
+        if 'k1' in at_limit or not names:
+            raise ValueError('The fit of {} reaches the slider range limit, the focal length or the detected lines '
+                             'do not suit this image'.format(', '.join(at_limit)))
+        values[[PARAMETERS.index(name) for name in at_limit]] = start_values[[PARAMETERS.index(n) for n in at_limit]]
+        values, reference_directions, at_limit = solve(names, values, points, labels)
+    rms = get_rms(values, points, labels, reference_directions)
+
+    # Further coefficients are kept only when they straighten the lines clearly
+    for extra_names in fit_steps[1:]:
+        trial, trial_directions, at_limit = solve(names + list(extra_names), values, points, labels)
+        trial_rms = get_rms(trial, points, labels, trial_directions)
+        if not at_limit and trial_rms < (1.0 - MIN_RMS_IMPROVEMENT) * rms:
+            names += list(extra_names)
+            values, reference_directions, rms = trial, trial_directions, trial_rms
+
+    slider_values = [int(round(v)) for v in values]
+    return FitResult(slider_values, rms, len(groups), method, time.perf_counter() - start)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Fit distortion coefficients from a checkerboard or straight lines')
+    parser.add_argument('image')
+    parser.add_argument('--focal-length', type=float, default=10.0)
+    parser.add_argument('--pattern', help='checkerboard inner corners, e.g. 9x6')
+    parser.add_argument('--parameters', help='coefficients to fit, e.g. k1,k2 (default: k1 for edges, for '
+                                             'checkerboards k1 plus k2 and p1/p2 when they straighten the lines)')
+    args = parser.parse_args(argv)
+
+    img = cv2.imdecode(np.fromfile(args.image, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        print('Cannot read {}'.format(args.image))
+        return 1
+    pattern_size = tuple(int(v) for v in args.pattern.lower().split('x')) if args.pattern else None
+
+    parameters = args.parameters.split(',') if args.parameters else None
+    try:
+        result = fit_coefficients(img, args.focal_length, parameters=parameters, pattern_size=pattern_size)
+    except ValueError as e:
+        print(e)
+        return 1
+    if result is None:
+        print('No checkerboard or straight lines found')
+        return 1
+    print(result)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,198 @@
+import argparse
+import glob
+import os
+import sys
+import time
+from pathlib import Path
+import cv2
+import numpy as np
+from distortion import DistortionCoefficients, parse_extra_coefficients
+from distortion_models import MODELS, get_model
+from remap_engine import RemapEngine, MAP_FORMATS
+from map_cache import MapCache
+from lens_profile import LensProfile, LensProject
+from export import get_encode_param
+
+# Per worker process state, set up once by init_worker
+remap_engine = None
+dist_coeff = None
+profile = None
+model = None
+
+
+def init_worker(coefficients, lens_profile, memory_limit, map_format='opencv', map_cache=None):
+    global remap_engine, dist_coeff, profile, model
+    # Parallelism comes from the process pool, keep OpenCV single threaded in each worker
+    cv2.setNumThreads(1)
+    remap_engine = RemapEngine(memory_limit, map_format, get_map_cache(map_cache))
+    dist_coeff = coefficients
+    profile = lens_profile
+    model = get_model(lens_profile.model)
+
+
+def undistort_file(src, dst, quality):
+    # Decode, remap and encode all happen in the worker process
+    # Returns the reason the file failed, or None
+    img = cv2.imdecode(np.fromfile(src, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        return src, 'cannot decode'
+
+    # One remap table per image size is built in each worker and reused for every following image
+    height, width = img.shape[:2]
+    camera_matrix = profile.get_camera_matrix(width, height)
+    img_undist = remap_engine.undistort(img, camera_matrix, dist_coeff, model.name)
+
+    ext = Path(dst).suffix.lower()
+    try:
+        ok, encoded = cv2.imencode(ext, img_undist, get_encode_param(ext, quality))
+    except cv2.error:
+        ok = False
+    if not ok:
+        return src, 'cannot encode as {}'.format(ext)
+    try:
+        encoded.tofile(dst)
+    except OSError as e:
+        return src, 'cannot write {}: {}'.format(dst, e)
+    return src, None
+
+
+def get_map_cache(directory):
+    # '' disables the disk cache, None selects the default directory
+    if directory == '':
+        return None
+    return MapCache(directory)
+
+
+def parse_coefficients(args, parser=None):
+    # Invalid options end with a usage error when the parser is given, a ValueError otherwise
+    try:
+        return get_coefficients(args)
+    except (ValueError, KeyError, OSError) as e:
+        message = e.args[0] if isinstance(e, KeyError) else str(e)
+        if parser is not None:
+            parser.error(message)
+        raise ValueError(message)
+
+
+def get_lens_profile(args, dist_coeff):
+    # With --profile the project's profile, it knows the sensor size its coefficients were tuned on
+    if args.profile:
+        return LensProject.load(args.profile).get_profile(args.profile_name)
+    return LensProfile.from_coefficients(dist_coeff, args.focal_length)
+
+
+def get_coefficients(args):
+    dist_coeff = DistortionCoefficients()
+    if args.profile:
+        # The lens profile replaces the coefficient options, including the focal length
+        profile = LensProject.load(args.profile).get_profile(args.profile_name)
+        if profile is None:
+            raise ValueError('{} has no lens profile'.format(args.profile))
+        profile.apply(dist_coeff)
+        args.focal_length = profile.focal_length
+        return dist_coeff
+
+    dist_coeff.set_model(args.model)
+    if args.sliders is not None:
+        dist_coeff.set_slider_values(*args.sliders)
+    else:
+        dist_coeff.k1 = args.k1
+        dist_coeff.k2 = args.k2
+        dist_coeff.k3 = args.k3
+        dist_coeff.p1 = args.p1
+        dist_coeff.p2 = args.p2
+    extra = parse_extra_coefficients(args.extra)
+    unknown = set(extra) - set(dist_coeff.get_model().extra_names)
+    if unknown:
+        raise ValueError('The {} model has no coefficient {}'.format(args.model, ', '.join(sorted(unknown))))
+    dist_coeff.extra = extra
+    return dist_coeff
+
+
+def get_output_path(src, output_dir, ext, root=None):
+    # Below root the input directories are mirrored, files of the same name in different directories stay apart
+    path = Path(output_dir) / (os.path.relpath(src, root) if root is not None else Path(src).name)
+    if ext:
+        path = path.with_suffix(ext if ext.startswith('.') else '.' + ext)
+    return path
+
+
+def add_coefficient_arguments(parser):
+    parser.add_argument('--sliders', type=float, nargs=5, metavar=('K1', 'K2', 'K3', 'P1', 'P2'),
+                        help='coefficients as slider integers, as copied by "Copy parameters"')
+    # argparse takes "-1e-5" for an option, negative raw coefficients need the --k1=-1e-5 form
+    for name in ('k1', 'k2', 'k3', 'p1', 'p2'):
+        parser.add_argument('--' + name, type=float, default=0.0,
+                            help='raw {} coefficient, write negative values as --{}=-1e-5'.format(name, name))
+    parser.add_argument('--focal-length', type=float, default=10.0)
+    parser.add_argument('--model', choices=list(MODELS), default='standard', help='distortion model')
+    parser.add_argument('--extra', default='',
+                        help='coefficients without a slider, e.g. "k4=0.01,k5=0,s1=-0.002" (fisheye k4 goes here)')
+    parser.add_argument('--profile', help='project file (.ldc) to take the lens profile from')
+    parser.add_argument('--profile-name', help='lens profile in the project, defaults to the active one')
+
+
+def add_map_cache_argument(parser):
+    parser.add_argument('--map-cache', default=None,
+                        help='on-disk remap table cache directory shared with the GUI, "" disables it')
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Headless batch lens distortion correction')
+    parser.add_argument('input', help='input glob, e.g. "captures/**/*.jpg"')
+    parser.add_argument('output_dir', help='output directory, mirrors the input tree below the common root')
+    add_coefficient_arguments(parser)
+    parser.add_argument('--ext', default='', help='output format extension, defaults to the input one')
+    parser.add_argument('--quality', type=int, default=98, help='JPEG/WebP quality')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--memory-limit', type=int, default=256, help='remap cache size per worker in MB')
+    parser.add_argument('--map-format', choices=MAP_FORMATS, default='opencv', help='remap table format')
+    add_map_cache_argument(parser)
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    files = sorted(glob.glob(args.input, recursive=True))
+    if not files:
+        print('No input files match {}'.format(args.input))
+        return 1
+    Path(args.output_dir).mkdir(parents=True, exist_ok=True)
+
+    dist_coeff = parse_coefficients(args, parser)
+    print(dist_coeff)
+
+    root = os.path.commonpath([os.path.dirname(os.path.abspath(f)) for f in files])
+    outputs = [get_output_path(os.path.abspath(f), args.output_dir, args.ext, root) for f in files]
+    for ext in sorted({path.suffix.lower() for path in outputs}):
+        if not cv2.haveImageWriter('image' + ext):
+            parser.error('Cannot write {} images, choose another format with --ext'.format(ext or 'extensionless'))
+    for directory in sorted({path.parent for path in outputs}):
+        directory.mkdir(parents=True, exist_ok=True)
+    outputs = [str(path) for path in outputs]
+
+    failed = 0
+    start = time.perf_counter()
+    # Imported here, stream, tiled and sweep import this module for its arguments and never start the pool
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker,
+                             initargs=(dist_coeff.get_distortion_coefficients(), get_lens_profile(args, dist_coeff),
+                                       args.memory_limit * 1024 * 1024, args.map_format,
+                                       args.map_cache)) as executor:
+        chunksize = max(1, len(files) // (4 * max(1, args.workers)))
+        for src, error in executor.map(undistort_file, files, outputs, [args.quality] * len(files),
+                                       chunksize=chunksize):
+            if error is not None:
+                failed += 1
+                print('Failed {}: {}'.format(src, error))
+    elapsed = time.perf_counter() - start
+
+    done = len(files) - failed
+    print('{} images in {:.2f} s ({:.2f} images/sec)'.format(done, elapsed, done / elapsed if elapsed > 0 else 0.0))
+    return 0 if failed == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
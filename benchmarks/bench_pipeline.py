@@ -0,0 +1,166 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+# Headless Qt, must be set before PyQt6 is imported
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+# Run from anywhere against the simulator modules in the parent directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cv2
+import numpy as np
+from PyQt6.QtGui import QGuiApplication, QImage, QPixmap, QColor
+from PyQt6.QtCore import Qt
+from distortion import DistortionCoefficients
+from distortion_models import get_camera_matrix
+from remap_engine import RemapEngine, MAP_FORMATS
+from render_cache import RenderCache
+
+# Slider values of the coefficient sets, from no correction to strong barrel correction
+COEFFICIENT_SETS = {
+    'zero': (0, 0, 0, 0, 0),
+    'moderate': (-100, -20, 0, 10, -10),
+    'strong': (-400, -200, -100, 50, -50),
+}
+
+LABEL_SIZE = (1280, 960)
+
+
+def get_peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024.0 * 1024.0) if sys.platform == 'darwin' else peak / 1024.0
+
+
+def make_image(megapixels):
+    # 4:3 synthetic test chart, a grid on top of noise so that compression does some real work
+    width = int(round(np.sqrt(megapixels * 1e6 * 4 / 3)))
+    height = int(round(width * 3 / 4))
+    rng = np.random.default_rng(0)
+    img = rng.integers(0, 64, size=(height, width, 3), dtype=np.uint8)
+    img[::max(1, height // 20), :] = 255
+    img[:, ::max(1, width // 20)] = 255
+    return img
+
+
+def time_stage(fn, repeat):
+    times = []
+    result = None
+    for _ in range(repeat):
+        t = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - t)
+    return times, result
+
+
+def summarize(times, megapixels):
+    times_ms = np.array(times) * 1000.0
+    p50 = float(np.percentile(times_ms, 50))
+    return {
+        'p50_ms': p50,
+        'p95_ms': float(np.percentile(times_ms, 95)),
+        'mp_per_s': megapixels / (p50 / 1000.0) if p50 > 0 else None,
+    }
+
+
+def bench_size(megapixels, coefficients, repeat, map_format):
+    img = make_image(megapixels)
+    height, width = img.shape[:2]
+    dist_coeff = DistortionCoefficients()
+    dist_coeff.set_slider_values(*coefficients)
+    camera_matrix = get_camera_matrix(width, height, 10.0)
+    dist = dist_coeff.get_distortion_coefficients()
+    engine = RemapEngine(map_format=map_format)
+    cache = RenderCache()
+
+    stages = {}
+    times, maps = time_stage(lambda: engine.build_maps(camera_matrix, dist, width, height), repeat)
+    stages['map_build'] = summarize(times, megapixels)
+
+    # Warm the cache once, the remap stage then measures cv2.remap alone
+    engine.get_maps(camera_matrix, dist, width, height)
+    times, img_undist = time_stage(lambda: engine.undistort(img, camera_matrix, dist), repeat)
+    stages['remap'] = summarize(times, megapixels)
+
+    def to_pixmap():
+        q_img = QImage(img_undist.data, width, height, img_undist.strides[0], QImage.Format.Format_BGR888)
+        return QPixmap.fromImage(q_img)
+    times, pixmap = time_stage(to_pixmap, repeat)
+    stages['color_conversion'] = summarize(times, megapixels)
+
+    times, scaled = time_stage(lambda: pixmap.scaled(LABEL_SIZE[0], LABEL_SIZE[1],
+                                                     Qt.AspectRatioMode.KeepAspectRatio), repeat)
+    stages['scaling'] = summarize(times, megapixels)
+
+    def paint_grid():
+        # Reset the overlay key so the grid is redrawn every time
+        cache.grid_key = None
+        return cache.compose(scaled, True, 8, QColor(255, 0, 0))
+    times, _ = time_stage(paint_grid, repeat)
+    stages['grid_painting'] = summarize(times, megapixels)
+
+    encode_param = [int(cv2.IMWRITE_JPEG_QUALITY), 98]
+    times, _ = time_stage(lambda: cv2.imencode('.jpg', img_undist, encode_param), repeat)
+    stages['jpeg_encode'] = summarize(times, megapixels)
+
+    return {
+        'megapixels': megapixels,
+        'width': width,
+        'height': height,
+        'stages': stages,
+        'peak_rss_mb': get_peak_rss_mb(),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the undistortion and display pipeline stages')
+    parser.add_argument('--sizes', default='1,4,12,24,50,100', help='image sizes in megapixels')
+    parser.add_argument('--coefficients', default=','.join(COEFFICIENT_SETS),
+                        help='coefficient sets: {}'.format(', '.join(COEFFICIENT_SETS)))
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--map-format', choices=MAP_FORMATS, default='opencv')
+    parser.add_argument('--output', help='JSON output file, defaults to stdout')
+    args = parser.parse_args(argv)
+
+    app = QGuiApplication.instance() or QGuiApplication(sys.argv[:1])
+
+    results = []
+    for megapixels in [float(v) for v in args.sizes.split(',')]:
+        for name in args.coefficients.split(','):
+            result = bench_size(megapixels, COEFFICIENT_SETS[name], args.repeat, args.map_format)
+            result['coefficients'] = name
+            results.append(result)
+            print('{:6.1f} MP {:9s} {}'.format(megapixels, name, ' '.join(
+                '{}={:.1f}ms'.format(stage, r['p50_ms']) for stage, r in result['stages'].items())),
+                file=sys.stderr)
+
+    report = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'opencv': cv2.__version__,
+        'cpu_count': os.cpu_count(),
+        'map_format': args.map_format,
+        'repeat': args.repeat,
+        'results': results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+    del app
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,55 @@
+import importlib
+import sys
+import time
+
+# Headless commands and their modules, only the one that runs is imported and none of them imports Qt
+COMMANDS = {
+    'batch': 'batch',
+    'stream': 'stream',
+    'tiled': 'tiled',
+    'autofit': 'autofit',
+    'sweep': 'sweep',
+    'serve': 'service',
+}
+
+USAGE = '''usage: cli.py [--startup-time] <command> [args]
+
+Headless lens distortion correction, run "cli.py <command> -h" for the options of a command.
+
+commands:
+  batch     undistort many images on a process pool
+  stream    undistort a video or image sequence
+  tiled     undistort a huge image tile by tile
+  autofit   fit coefficients from a checkerboard or straight lines
+  sweep     contact sheet of coefficient ranges
+  serve     local HTTP service undistorting images and points'''
+
+
+def main(argv=None):
+    argv = list(sys.argv[1:] if argv is None else argv)
+    start = time.perf_counter()
+    # Prints the time to import the command, and checks the headless path stays free of Qt
+    startup_time = '--startup-time' in argv
+    if startup_time:
+        argv.remove('--startup-time')
+
+    if not argv or argv[0] in ('-h', '--help'):
+        print(USAGE)
+        return 0
+    if argv[0] not in COMMANDS:
+        print('Unknown command {}\n\n{}'.format(argv[0], USAGE), file=sys.stderr)
+        return 2
+
+    module = importlib.import_module(COMMANDS[argv[0]])
+    if startup_time:
+        qt_modules = sorted(name for name in sys.modules if name.split('.')[0] in ('PyQt6', 'PyQt5', 'PySide6'))
+        print('{} imported in {:.1f} ms, Qt {}'.format(argv[0], (time.perf_counter() - start) * 1000.0,
+                                                       'imported: ' + ', '.join(qt_modules) if qt_modules
+                                                       else 'not imported'))
+        if len(argv) == 1:
+            return 0
+    return module.main(argv[1:])
+
+
+if __name__ == '__main__':
+    sys.exit(main())
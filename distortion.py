@@ -0,0 +1,87 @@
+from distortion_models import get_model
+
+
+class DistortionCoefficients:
+    def __init__(self, k1=0.0, k2=0.0, k3=0.0, p1=0.0, p2=0.0):
+        self.k1 = k1
+        self.k2 = k2
+        self.k3 = k3
+        self.p1 = p1
+        self.p2 = p2
+
+        # Step of each coefficients adjustment
+        self.step_k1 = 1.0e-7
+        self.step_k2 = 1.0e-12
+        self.step_k3 = 1.0e-16
+        self.step_p1 = 0.000001
+        self.step_p2 = 0.000001
+
+        # Distortion model, and the coefficients of that model that have no slider (k4, s1, tau_x, ...)
+        self.model = 'standard'
+        self.extra = {}
+
+    def __str__(self):
+        text = 'K1 = {}, K2 = {}, K3 = {}, P1 = {}, P2 = {}'.format(self.k1, self.k2, self.k3, self.p1, self.p2)
+        if self.model != 'standard':
+            text = '{}: {}'.format(self.model, ', '.join(
+                '{} = {}'.format(name.upper(), value) for name, value in self.get_values().items()
+                if name in get_model(self.model).coefficient_names))
+        return text
+
+    def get_model(self):
+        return get_model(self.model)
+
+    def set_model(self, name):
+        # Slider steps follow the model and slider positions are kept, coefficients of unused sliders are zeroed
+        model = get_model(name)
+        self.model = model.name
+        self.extra = {k: v for k, v in self.extra.items() if k in model.extra_names}
+        for slider, step in zip(('k1', 'k2', 'k3', 'p1', 'p2'), model.slider_steps):
+            if step is None:
+                setattr(self, slider, 0.0)
+                continue
+            old_step = getattr(self, 'step_' + slider)
+            setattr(self, slider, getattr(self, slider) / old_step * step)
+            setattr(self, 'step_' + slider, step)
+
+    def get_values(self):
+        values = {'k1': self.k1, 'k2': self.k2, 'k3': self.k3, 'p1': self.p1, 'p2': self.p2}
+        values.update(self.extra)
+        return values
+
+    def get_distortion_coefficients(self):
+        # Coefficient vector in the OpenCV order of the model, (5, 1) for the standard model
+        return self.get_model().get_coefficient_vector(self.get_values())
+
+    def get_slider_values(self):
+        # Coefficients in (linear) slider units, fractional when values were typed in exactly
+        return [getattr(self, name) / getattr(self, 'step_' + name) for name in ('k1', 'k2', 'k3', 'p1', 'p2')]
+
+    def set_slider_values(self, k1=0, k2=0, k3=0, p1=0, p2=0):
+        self.k1 = k1 * self.step_k1
+        self.k2 = k2 * self.step_k2
+        self.k3 = k3 * self.step_k3
+        self.p1 = p1 * self.step_p1
+        self.p2 = p2 * self.step_p2
+
+    def reset(self):
+        self.k1 = 0.0
+        self.k2 = 0.0
+        self.k3 = 0.0
+        self.p1 = 0.0
+        self.p2 = 0.0
+        self.extra = {}
+
+
+def parse_extra_coefficients(text):
+    # "k4=0.01,s1=-0.002" style list of the coefficients without a slider
+    extra = {}
+    for item in text.replace(' ', ',').split(','):
+        if not item:
+            continue
+        name, _, value = item.partition('=')
+        try:
+            extra[name.strip().lower()] = float(value)
+        except ValueError:
+            raise ValueError('Invalid coefficient {}, expected name=value'.format(item))
+    return extra
@@ -0,0 +1,119 @@
+from collections import OrderedDict
+import cv2
+import numpy as np
+
+# The default of 5 iterations is not enough to invert strong distortion
+UNDISTORT_POINTS_CRITERIA = (cv2.TERM_CRITERIA_COUNT | cv2.TERM_CRITERIA_EPS, 20, 1e-9)
+
+
+def get_camera_matrix(width, height, focal_length, scale=1.0):
+    # Scaling the focal length with the image keeps normalized coordinates, and so the coefficients, unchanged
+    cam = np.eye(3, dtype=np.float32)
+    cam[0, 2] = width / 2.0
+    cam[1, 2] = height / 2.0
+    cam[0, 0] = focal_length * scale
+    cam[1, 1] = focal_length * scale
+    return cam
+
+
+def get_rect_camera_matrix(camera_matrix, rect, zoom=1.0):
+    # Moving the principal point makes OpenCV compute the maps of the output rect (x, y, w, h) only, zoom scales
+    # the output against the source image and rect is then in zoomed output pixels
+    new_camera_matrix = np.array(camera_matrix, dtype=np.float64, copy=True)
+    new_camera_matrix[:2] *= zoom
+    new_camera_matrix[0, 2] -= rect[0]
+    new_camera_matrix[1, 2] -= rect[1]
+    return new_camera_matrix
+
+
+class DistortionModel:
+    name = 'standard'
+    title = 'Standard (5 coefficients)'
+    # OpenCV coefficient vector order
+    coefficient_names = ('k1', 'k2', 'p1', 'p2', 'k3')
+    # Steps of the K1, K2, K3, P1 and P2 sliders, None when the model does not use that slider
+    slider_steps = (1.0e-7, 1.0e-12, 1.0e-16, 0.000001, 0.000001)
+
+    @property
+    def extra_names(self):
+        # Coefficients without a slider, edited as text
+        return tuple(n for n in self.coefficient_names if n not in ('k1', 'k2', 'k3', 'p1', 'p2'))
+
+    def get_coefficient_vector(self, values):
+        dist_coeff = np.zeros((len(self.coefficient_names), 1), dtype=np.float64)
+        for i, name in enumerate(self.coefficient_names):
+            dist_coeff[i, 0] = values.get(name, 0.0)
+        return dist_coeff
+
+    def get_camera_matrix(self, width, height, focal_length, scale=1.0):
+        return get_camera_matrix(width, height, focal_length, scale)
+
+    def undistort_points(self, points, camera_matrix, dist_coeff):
+        # Undistorted pixel positions of distorted (N, 2) pixel positions
+        points = np.ascontiguousarray(points, dtype=np.float64).reshape(-1, 1, 2)
+        if hasattr(cv2, 'undistortPointsIter'):
+            # OpenCV 4 takes the termination criteria in a separate function
+            return cv2.undistortPointsIter(points, camera_matrix, dist_coeff, None, camera_matrix,
+                                           UNDISTORT_POINTS_CRITERIA).reshape(-1, 2)
+        return cv2.undistortPoints(points, camera_matrix, dist_coeff, R=None, P=camera_matrix,
+                                   criteria=UNDISTORT_POINTS_CRITERIA).reshape(-1, 2)
+
+    def build_maps(self, camera_matrix, dist_coeff, width, height, rect=None, map_type=cv2.CV_32FC1, zoom=1.0):
+        rect = rect if rect is not None else (0, 0, width, height)
+        return cv2.initUndistortRectifyMap(camera_matrix, dist_coeff, None,
+                                           get_rect_camera_matrix(camera_matrix, rect, zoom), (rect[2], rect[3]),
+                                           map_type)
+
+
+class RationalModel(DistortionModel):
+    name = 'rational'
+    title = 'Rational (8 coefficients)'
+    coefficient_names = ('k1', 'k2', 'p1', 'p2', 'k3', 'k4', 'k5', 'k6')
+
+
+class ThinPrismModel(DistortionModel):
+    name = 'thin_prism'
+    title = 'Rational + thin prism (12 coefficients)'
+    coefficient_names = RationalModel.coefficient_names + ('s1', 's2', 's3', 's4')
+
+
+class TiltedModel(DistortionModel):
+    name = 'tilted'
+    title = 'Rational + thin prism + tilt (14 coefficients)'
+    coefficient_names = ThinPrismModel.coefficient_names + ('tau_x', 'tau_y')
+
+
+class FisheyeModel(DistortionModel):
+    name = 'fisheye'
+    title = 'Fisheye (4 coefficients)'
+    coefficient_names = ('k1', 'k2', 'k3', 'k4')
+    slider_steps = (0.001, 0.001, 0.001, None, None)
+
+    def get_camera_matrix(self, width, height, focal_length, scale=1.0):
+        # The fisheye model works on the ray angle, a focal length of half the image size maps the image edge
+        # to 45 degrees. The 10 px default of the other models would put every pixel near 90 degrees.
+        return get_camera_matrix(width, height, 0.5 * max(width, height))
+
+    def undistort_points(self, points, camera_matrix, dist_coeff):
+        points = np.ascontiguousarray(points, dtype=np.float64).reshape(-1, 1, 2)
+        camera_matrix = np.asarray(camera_matrix, dtype=np.float64)
+        return cv2.fisheye.undistortPoints(points, camera_matrix, dist_coeff.reshape(4, 1), None, camera_matrix,
+                                           criteria=UNDISTORT_POINTS_CRITERIA).reshape(-1, 2)
+
+    def build_maps(self, camera_matrix, dist_coeff, width, height, rect=None, map_type=cv2.CV_32FC1, zoom=1.0):
+        rect = rect if rect is not None else (0, 0, width, height)
+        return cv2.fisheye.initUndistortRectifyMap(np.asarray(camera_matrix, dtype=np.float64),
+                                                   dist_coeff.reshape(4, 1), np.eye(3),
+                                                   get_rect_camera_matrix(camera_matrix, rect, zoom),
+                                                   (rect[2], rect[3]), map_type)
+
+
+MODELS = OrderedDict((model.name, model) for model in (DistortionModel(), RationalModel(), ThinPrismModel(),
+                                                        TiltedModel(), FisheyeModel()))
+
+
+def get_model(name):
+    try:
+        return MODELS[name]
+    except KeyError:
+        raise ValueError('Unknown distortion model {}'.format(name))
@@ -0,0 +1,130 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import cv2
+import numpy as np
+
+# Save dialog filters, the selected filter decides the format when the file name has no known extension
+IMAGE_FILTERS = ('Jpeg (*.jpg *.jpeg)', 'PNG (*.png)', 'TIFF (*.tif *.tiff)', 'WebP (*.webp)',
+                 'WebP lossless (*.webp)')
+FILTER_EXTENSIONS = {IMAGE_FILTERS[0]: '.jpg', IMAGE_FILTERS[1]: '.png', IMAGE_FILTERS[2]: '.tif',
+                     IMAGE_FILTERS[3]: '.webp', IMAGE_FILTERS[4]: '.webp'}
+LOSSLESS_EXTENSIONS = ('.png', '.tif', '.tiff', '.bmp')
+MAP_FILTERS = ('NumPy archive (*.npz)', 'NumPy array (*.npy)')
+
+CHUNK_SIZE = 8 * 1024 * 1024
+
+# OpenCV's TIFF compression tag value for LZW
+TIFF_COMPRESSION_LZW = 5
+
+
+def get_encode_param(ext, quality=98, lossless=False):
+    ext = ext.lower()
+    if ext in ('.jpg', '.jpeg'):
+        return [int(cv2.IMWRITE_JPEG_QUALITY), quality]
+    if ext == '.webp':
+        # OpenCV switches WebP to lossless for quality values above 100
+        return [int(cv2.IMWRITE_WEBP_QUALITY), 101 if lossless else quality]
+    if ext == '.png':
+        return [int(cv2.IMWRITE_PNG_COMPRESSION), 3]
+    if ext in ('.tif', '.tiff'):
+        return [int(cv2.IMWRITE_TIFF_COMPRESSION), TIFF_COMPRESSION_LZW]
+    return []
+
+
+def get_save_path(path, selected_filter=''):
+    # Adds the extension of the selected dialog filter when the file name has none
+    path = Path(path)
+    if not path.suffix and selected_filter in FILTER_EXTENSIONS:
+        path = path.with_suffix(FILTER_EXTENSIONS[selected_filter])
+    return path
+
+
+def is_lossless(path, selected_filter=''):
+    return Path(path).suffix.lower() in LOSSLESS_EXTENSIONS or selected_filter == IMAGE_FILTERS[4]
+
+
+def encode_image(img, ext, quality=98, lossless=False):
+    ok, buffer = cv2.imencode(ext, img, get_encode_param(ext, quality, lossless))
+    if not ok:
+        raise IOError('Cannot encode image as {}'.format(ext))
+    return buffer
+
+
+def write_chunked(path, buffer, progress=None, chunk_size=CHUNK_SIZE):
+    # Written in chunks to report progress, OpenCV has encoded the whole image into buffer by now
+    view = memoryview(buffer).cast('B')
+    total = len(view)
+    with open(path, 'wb') as f:
+        for offset in range(0, total, chunk_size):
+            f.write(view[offset:offset + chunk_size])
+            if progress is not None:
+                progress(min(offset + chunk_size, total) / total)
+
+
+def save_maps(path, map1, map2, camera_matrix=None, dist_coeff=None):
+    # Fixed-point tables are stored as float32 so downstream tools can use them without OpenCV internals
+    if map1.dtype != np.float32 or map1.ndim == 3:
+        map1, map2 = cv2.convertMaps(map1, map2, cv2.CV_32FC1)
+
+    if Path(path).suffix.lower() == '.npy':
+        np.save(str(path), np.stack((map1, map2), axis=-1))
+    else:
+        extra = {}
+        if camera_matrix is not None:
+            extra['camera_matrix'] = np.asarray(camera_matrix)
+        if dist_coeff is not None:
+            extra['dist_coeff'] = np.asarray(dist_coeff)
+        np.savez(str(path), map_x=map1, map_y=map2, **extra)
+
+
+def export_image(path, undistort, quality=98, lossless=False, progress=None):
+    # undistort() produces the full resolution image, progress(fraction, message) reports each step
+    def report(fraction, message):
+        if progress is not None:
+            progress(fraction, message)
+
+    report(0.0, 'Undistorting')
+    img_undist = undistort()
+
+    report(0.4, 'Encoding')
+    ext = Path(path).suffix.lower()
+    buffer = encode_image(img_undist, ext, quality, lossless)
+    del img_undist
+
+    report(0.6, 'Writing')
+    write_chunked(path, buffer, lambda fraction: report(0.6 + 0.4 * fraction, 'Writing'))
+    report(1.0, 'Saved {}'.format(path))
+    return path
+
+
+class Exporter:
+    def __init__(self, max_workers=1):
+        # Exports run in the background, one at a time by default so they do not compete for memory
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='export')
+        self.lock = threading.Lock()
+        self.active = 0
+
+    def submit(self, fn, *args, done=None, **kwargs):
+        def run():
+            try:
+                result = fn(*args, **kwargs)
+                error = None
+            except Exception as e:
+                result = None
+                error = e
+            with self.lock:
+                self.active -= 1
+            if done is not None:
+                done(result, error)
+            return result
+
+        with self.lock:
+            self.active += 1
+        return self.executor.submit(run)
+
+    def is_busy(self):
+        return self.active > 0
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
@@ -0,0 +1,37 @@
+import threading
+from collections import OrderedDict
+import numpy as np
+
+
+class BufferRing:
+    def __init__(self, depth=3, max_shapes=2):
+        # Only the newest render is displayed and it is copied into a pixmap as soon as it arrives, so the
+        # render thread never comes round to a buffer that is still being read
+        self.depth = depth
+        # Coarse previews and refined renders alternate between two sizes, both keep their buffers
+        self.max_shapes = max_shapes
+        self.rings = OrderedDict()
+        self.lock = threading.Lock()
+
+    def next(self, shape, dtype=np.uint8):
+        key = (tuple(shape), np.dtype(dtype))
+        with self.lock:
+            ring = self.rings.get(key)
+            if ring is None:
+                # Buffers of a dropped size stay alive as long as a render result still references them
+                ring = self.rings[key] = [[np.empty(shape, dtype) for _ in range(self.depth)], 0]
+                while len(self.rings) > self.max_shapes:
+                    self.rings.popitem(last=False)
+            self.rings.move_to_end(key)
+            buffers, index = ring
+            ring[1] = (index + 1) % self.depth
+            return buffers[index]
+
+    @property
+    def nbytes(self):
+        with self.lock:
+            return sum(buffer.nbytes for buffers, _ in self.rings.values() for buffer in buffers)
+
+    def clear(self):
+        with self.lock:
+            self.rings.clear()
@@ -0,0 +1,209 @@
+import cv2
+import numpy as np
+
+# Half resolution displacements are stored as int16 in 1/scale pixels, scale is the largest power of two up to
+# HALF_MAP_MAX_SCALE (the precision of CV_16SC2 tables) that fits the largest displacement. Tables that would need
+# a scale below HALF_MAP_MIN_SCALE, displacements beyond 4096 px, do not fit the format.
+HALF_MAP_MAX_SCALE = 32
+HALF_MAP_MIN_SCALE = 8
+
+# Half resolution maps are expanded and applied this many output rows at a time, even so strips start on a sample
+HALF_MAP_STRIP_ROWS = 128
+
+
+def split_coefficients(dist_coeff):
+    # OpenCV order: k1, k2, p1, p2, k3
+    d = np.zeros(5, dtype=np.float64)
+    values = np.asarray(dist_coeff, dtype=np.float64).ravel()[:5]
+    d[:len(values)] = values
+    return d
+
+
+def distort_normalized(x, y, dist_coeff):
+    # Forward 5-term Brown-Conrady model on normalized coordinates
+    k1, k2, p1, p2, k3 = split_coefficients(dist_coeff)
+    x2 = x * x
+    y2 = y * y
+    xy = x * y
+    r2 = x2 + y2
+    radial = 1.0 + r2 * (k1 + r2 * (k2 + r2 * k3))
+    xd = x * radial + 2.0 * p1 * xy + p2 * (r2 + 2.0 * x2)
+    yd = y * radial + p1 * (r2 + 2.0 * y2) + 2.0 * p2 * xy
+    return xd, yd
+
+
+def undistort_normalized(xd, yd, dist_coeff, iterations=10):
+    # Inverse model by fixed point iteration, the same scheme as cv2.undistortPoints
+    k1, k2, p1, p2, k3 = split_coefficients(dist_coeff)
+    x = np.array(xd, dtype=np.float64, copy=True)
+    y = np.array(yd, dtype=np.float64, copy=True)
+    for _ in range(iterations):
+        x2 = x * x
+        y2 = y * y
+        xy = x * y
+        r2 = x2 + y2
+        icdist = 1.0 / (1.0 + r2 * (k1 + r2 * (k2 + r2 * k3)))
+        delta_x = 2.0 * p1 * xy + p2 * (r2 + 2.0 * x2)
+        delta_y = p1 * (r2 + 2.0 * y2) + 2.0 * p2 * xy
+        x = (xd - delta_x) * icdist
+        y = (yd - delta_y) * icdist
+    return x, y
+
+
+def get_intrinsics(camera_matrix):
+    cam = np.asarray(camera_matrix, dtype=np.float64)
+    return cam[0, 0], cam[1, 1], cam[0, 2], cam[1, 2]
+
+
+def distort_points(points, camera_matrix, dist_coeff):
+    # Nx2 undistorted pixel positions -> positions in the distorted (source) image
+    fx, fy, cx, cy = get_intrinsics(camera_matrix)
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    xd, yd = distort_normalized((points[:, 0] - cx) / fx, (points[:, 1] - cy) / fy, dist_coeff)
+    return np.stack((xd * fx + cx, yd * fy + cy), axis=1)
+
+
+def undistort_points(points, camera_matrix, dist_coeff, iterations=10):
+    # Nx2 distorted (source) pixel positions -> positions in the undistorted image
+    fx, fy, cx, cy = get_intrinsics(camera_matrix)
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    x, y = undistort_normalized((points[:, 0] - cx) / fx, (points[:, 1] - cy) / fy, dist_coeff, iterations)
+    return np.stack((x * fx + cx, y * fy + cy), axis=1)
+
+
+def build_undistort_maps(camera_matrix, dist_coeff, width, height, rect=None, step=1):
+    # Float32 maps like cv2.initUndistortRectifyMap, optionally only for the output rect (x, y, w, h)
+    # and sampled every `step` pixels
+    x0, y0, w, h = rect if rect is not None else (0, 0, width, height)
+    fx, fy, cx, cy = get_intrinsics(camera_matrix)
+    x = (np.arange(x0, x0 + w, step, dtype=np.float64) - cx) / fx
+    y = (np.arange(y0, y0 + h, step, dtype=np.float64) - cy) / fy
+    xd, yd = distort_normalized(x[np.newaxis, :], y[:, np.newaxis], dist_coeff)
+    map_x = (xd * fx + cx).astype(np.float32)
+    map_y = (yd * fy + cy).astype(np.float32)
+    return map_x, map_y
+
+
+def to_fixed_point(map_x, map_y):
+    # CV_16SC2 integer positions plus CV_16UC1 interpolation table indices
+    return cv2.convertMaps(map_x, map_y, cv2.CV_16SC2)
+
+
+class HalfResMaps:
+    def __init__(self, camera_matrix, dist_coeff, width, height, rect=None, maps=None):
+        # Displacements from the identity grid as fixed point int16, ValueError when they do not fit.
+        # Full resolution float maps of other distortion models can be given in maps, they are subsampled.
+        x0, y0, w, h = rect if rect is not None else (0, 0, width, height)
+        self.x0 = x0
+        self.y0 = y0
+        self.width = w
+        self.height = h
+
+        if maps is None:
+            map_x, map_y = build_undistort_maps(camera_matrix, dist_coeff, width, height, (x0, y0, w, h), step=2)
+        else:
+            map_x, map_y = maps[0][::2, ::2], maps[1][::2, ::2]
+        grid_x = np.arange(x0, x0 + w, 2, dtype=np.float32)[np.newaxis, :]
+        grid_y = np.arange(y0, y0 + h, 2, dtype=np.float32)[:, np.newaxis]
+        dx = map_x - grid_x
+        dy = map_y - grid_y
+        self.scale = get_half_map_scale(dx, dy)
+        self.dx = np.round(dx * self.scale).astype(np.int16)
+        self.dy = np.round(dy * self.scale).astype(np.int16)
+
+    @classmethod
+    def from_displacements(cls, dx, dy, width, height, x0=0, y0=0, scale=HALF_MAP_MAX_SCALE):
+        # Wraps stored displacements, e.g. memory-mapped from the disk cache, without computing anything
+        maps = cls.__new__(cls)
+        maps.scale = scale
+        maps.x0 = x0
+        maps.y0 = y0
+        maps.width = width
+        maps.height = height
+        maps.dx = dx
+        maps.dy = dy
+        return maps
+
+    @property
+    def nbytes(self):
+        return self.dx.nbytes + self.dy.nbytes
+
+    def expand(self):
+        # Bilinear upsampling of the displacements back to full resolution float32 maps
+        return self.expand_rows(0, self.height)
+
+    def expand_rows(self, start, stop, maps=None):
+        # Full resolution maps of the output rows start to stop, start is even. Only the samples around the strip
+        # are turned into positions and upsampled, the values are the same as expanding the whole table.
+        rows, cols = self.dx.shape
+        first = max(min(start // 2, rows - 2), 0)
+        last = min(rows, stop // 2 + 1)
+        if maps is None:
+            maps = np.empty((2, stop - start, self.width), dtype=np.float32)
+        grid_x = np.arange(self.x0, self.x0 + 2 * cols, 2, dtype=np.float32)[np.newaxis, :]
+        grid_y = np.arange(self.y0 + 2 * first, self.y0 + 2 * last, 2, dtype=np.float32)[:, np.newaxis]
+        for d, grid, out in zip((self.dx, self.dy), (grid_x, grid_y), maps):
+            samples = get_sample_positions(d[first:last], self.scale, grid)
+            upsample2(samples[start // 2 - first:], out)
+        return maps[0], maps[1]
+
+    def remap(self, img, interpolation=cv2.INTER_LINEAR, dst=None, strip_rows=HALF_MAP_STRIP_ROWS):
+        # Remaps strip by strip, full resolution maps are only ever expanded into two strip sized buffers
+        shape = (self.height, self.width) + img.shape[2:]
+        if dst is None or dst.shape != shape or dst.dtype != img.dtype:
+            dst = np.empty(shape, img.dtype)
+        buffers = np.empty((2, min(strip_rows, self.height), self.width), dtype=np.float32)
+        for start in range(0, self.height, strip_rows):
+            stop = min(start + strip_rows, self.height)
+            map_x, map_y = self.expand_rows(start, stop, buffers[:, :stop - start])
+            cv2.remap(img, map_x, map_y, interpolation, dst=dst[start:stop], borderMode=cv2.BORDER_CONSTANT)
+        return dst
+
+
+def get_half_map_scale(dx, dy):
+    largest = max(np.max(np.abs(dx), initial=0.0), np.max(np.abs(dy), initial=0.0))
+    if not np.isfinite(largest):
+        raise ValueError('Displacements are not finite')
+    scale = HALF_MAP_MAX_SCALE
+    while scale >= HALF_MAP_MIN_SCALE:
+        if largest * scale <= np.iinfo(np.int16).max:
+            return scale
+        scale //= 2
+    raise ValueError('Displacements of {:.0f} px do not fit the half map format'.format(largest))
+
+
+def get_sample_positions(displacements, scale, grid):
+    # Positions of the samples, with one more row and column continuing the last two linearly for the odd last
+    # pixel of an even size
+    rows, cols = displacements.shape
+    out = np.empty((rows + 1, cols + 1), dtype=np.float32)
+    samples = out[:rows, :cols]
+    np.multiply(displacements, np.float32(1.0 / scale), out=samples)
+    samples += grid
+    out[:rows, cols] = 2.0 * samples[:, -1] - samples[:, -2] if cols > 1 else samples[:, -1]
+    out[rows] = 2.0 * out[rows - 1] - out[rows - 2] if rows > 1 else out[rows - 1]
+    return out
+
+
+def upsample2(samples, out):
+    # Samples sit on even pixels, odd pixels are the mean of their neighbours. The samples reach one row and
+    # column beyond the last even pixel of out.
+    height = out.shape[0]
+    even = (height + 1) // 2
+    upsample_columns(samples[:even], out[0::2])
+    inner = (height - 1) // 2
+    np.add(out[0:2 * inner:2], out[2:2 * inner + 1:2], out=out[1:2 * inner:2])
+    out[1:2 * inner:2] *= 0.5
+    if height % 2 == 0:
+        # The even row below the last odd one is outside out
+        upsample_columns(samples[even:even + 1], out[-1:])
+        out[-1] += out[-2]
+        out[-1] *= 0.5
+    return out
+
+
+def upsample_columns(samples, out):
+    width = out.shape[1]
+    out[:, 0::2] = samples[:, :(width + 1) // 2]
+    np.add(samples[:, :width // 2], samples[:, 1:width // 2 + 1], out=out[:, 1::2])
+    out[:, 1::2] *= 0.5
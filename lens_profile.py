@@ -0,0 +1,112 @@
+import json
+import os
+from pathlib import Path
+from distortion_models import get_model
+
+PROJECT_VERSION = 1
+PROJECT_FILTERS = ('LDC project (*.ldc)', 'All Files (*.*)')
+
+
+class LensProfile:
+    def __init__(self, name='', model='standard', coefficients=None, focal_length=10.0, width=None, height=None):
+        self.name = name
+        self.model = get_model(model).name
+        # Coefficient values by name (k1, p1, k4, ...), not slider units
+        self.coefficients = dict(coefficients or {})
+        self.focal_length = focal_length
+        # Sensor size the coefficients were tuned for
+        self.width = width
+        self.height = height
+
+    def __str__(self):
+        size = ' {}x{}'.format(self.width, self.height) if self.width and self.height else ''
+        return '{} ({}{})'.format(self.name or 'unnamed', self.model, size)
+
+    @classmethod
+    def from_coefficients(cls, dist_coeff, focal_length, width=None, height=None, name=''):
+        names = get_model(dist_coeff.model).coefficient_names
+        values = dist_coeff.get_values()
+        return cls(name, dist_coeff.model, {n: values.get(n, 0.0) for n in names}, focal_length, width, height)
+
+    def apply(self, dist_coeff):
+        model = get_model(self.model)
+        dist_coeff.reset()
+        dist_coeff.set_model(model.name)
+        for name in ('k1', 'k2', 'k3', 'p1', 'p2'):
+            setattr(dist_coeff, name, float(self.coefficients.get(name, 0.0)))
+        dist_coeff.extra = {n: float(self.coefficients.get(n, 0.0)) for n in model.extra_names}
+
+    def get_focal_length(self, width):
+        # Coefficients are in pixels of the sensor the profile was tuned on, images of another width scale the camera
+        return self.focal_length * width / self.width if self.width else self.focal_length
+
+    def get_camera_matrix(self, width, height):
+        return get_model(self.model).get_camera_matrix(width, height, self.get_focal_length(width))
+
+    def matches_size(self, width, height):
+        return self.width == width and self.height == height
+
+    def to_dict(self):
+        return {'name': self.name, 'model': self.model, 'coefficients': self.coefficients,
+                'focal_length': self.focal_length, 'width': self.width, 'height': self.height}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data.get('name', ''), data.get('model', 'standard'), data.get('coefficients'),
+                   data.get('focal_length', 10.0), data.get('width'), data.get('height'))
+
+
+class LensProject:
+    def __init__(self, profiles=None, image=None, active=0):
+        self.profiles = list(profiles or [])
+        # Image the project was saved with, absolute or relative to the project file
+        self.image = image
+        self.active = active
+
+    def get_profile(self, name=None):
+        if name is not None:
+            for profile in self.profiles:
+                if profile.name == name:
+                    return profile
+            raise KeyError('No lens profile named {}'.format(name))
+        if not self.profiles:
+            return None
+        return self.profiles[min(self.active, len(self.profiles) - 1)]
+
+    def set_profile(self, profile):
+        # Replaces the profile with the same name, the stored profile becomes the active one
+        for i, existing in enumerate(self.profiles):
+            if existing.name == profile.name:
+                self.profiles[i] = profile
+                self.active = i
+                return
+        self.profiles.append(profile)
+        self.active = len(self.profiles) - 1
+
+    def save(self, path):
+        path = Path(path)
+        image = self.image
+        if image is not None:
+            # Relative paths keep a project folder movable
+            try:
+                image = os.path.relpath(str(image), str(path.parent))
+            except ValueError:
+                image = str(image)
+        data = {'version': PROJECT_VERSION, 'image': image, 'active': self.active,
+                'profiles': [profile.to_dict() for profile in self.profiles]}
+        tmp = path.with_name(path.name + '.tmp')
+        with open(str(tmp), 'w') as f:
+            json.dump(data, f, indent=2)
+        os.replace(str(tmp), str(path))
+
+    @classmethod
+    def load(cls, path):
+        path = Path(path)
+        with open(str(path)) as f:
+            data = json.load(f)
+        if data.get('version', 0) > PROJECT_VERSION:
+            raise ValueError('{} was written by a newer version'.format(path))
+        image = data.get('image')
+        if image is not None:
+            image = str((path.parent / image).resolve())
+        return cls([LensProfile.from_dict(p) for p in data.get('profiles', [])], image, data.get('active', 0))
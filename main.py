@@ -1,53 +1,60 @@
 import sys
-from PyQt6.QtWidgets import QMainWindow, QApplication, QFileDialog
-from PyQt6.QtGui import QPixmap, QImage, QResizeEvent, QPainter, QPen, QColor, QMouseEvent
-from PyQt6.QtCore import Qt
+import os
+import math
+from profiling import FrameProfiler, StartupTimer
+
+# Started before the heavy imports below, --startup-time prints every stage up to the first paint
+startup_timer = StartupTimer()
+
+from PyQt6.QtWidgets import QMainWindow, QApplication, QFileDialog, QInputDialog, QDialog, QLabel, QVBoxLayout
+from PyQt6.QtGui import QPixmap, QImage, QResizeEvent, QColor, QMouseEvent, QAction, QActionGroup, QDoubleValidator
+from PyQt6.QtCore import Qt, QTimer, QLocale, pyqtSignal
 from ui.main_ui import Ui_MainWindow
 import cv2
 import numpy as np
 from pathlib import Path
-import pyperclip
+from distortion import DistortionCoefficients, parse_extra_coefficients
+from distortion_models import MODELS
+from remap_engine import RemapEngine
+from render_scheduler import RenderScheduler
+from render_cache import RenderCache
+from map_cache import MapCache
+from lens_profile import LensProfile, LensProject, PROJECT_FILTERS
+from frame_buffers import BufferRing
+from viewport import Viewport, ViewportRenderer, get_fit_level
+from slider_scale import SliderScale, SCALES, SLIDER_RANGE, format_coefficient
+from export import Exporter, export_image, save_maps, get_save_path, is_lossless, IMAGE_FILTERS, MAP_FILTERS
+import tempfile
+import copy
+from functools import partial
+
+# pyperclip and the stream, auto-fit, sweep, tiled and batch modules are imported when their menu item is first
+# used, none of them is needed to show the window
+startup_timer.mark('imports')
 
 version = 'v1.3'
 
+# Images larger than this are saved through the tiled engine instead of full size remap tables
+TILED_SAVE_PIXELS = 40 * 1000 * 1000
 
-class DistortionCoefficients:
-    def __init__(self, k1=0.0, k2=0.0, k3=0.0, p1=0.0, p2=0.0):
-        self.k1 = k1
-        self.k2 = k2
-        self.k3 = k3
-        self.p1 = p1
-        self.p2 = p2
-
-        # Step of each coefficients adjustment
-        self.step_k1 = 1.0e-7
-        self.step_k2 = 1.0e-12
-        self.step_k3 = 1.0e-16
-        self.step_p1 = 0.000001
-        self.step_p2 = 0.000001
-
-    def __str__(self):
-        return 'K1 = {}, K2 = {}, K3 = {}, P1 = {}, P2 = {}'.format(self.k1, self.k2, self.k3, self.p1, self.p2)
-
-    def get_distortion_coefficients(self):
-        dist_coeff = np.zeros((5, 1), dtype=np.float64)
-        dist_coeff[0, 0] = self.k1
-        dist_coeff[1, 0] = self.k2
-        dist_coeff[4, 0] = self.k3
-        dist_coeff[2, 0] = self.p1
-        dist_coeff[3, 0] = self.p2
-        return dist_coeff
-
-    def reset(self):
-        self.k1 = 0.0
-        self.k2 = 0.0
-        self.k3 = 0.0
-        self.p1 = 0.0
-        self.p2 = 0.0
+# Time the window size has to stay unchanged before the preview is re-rendered at the new size
+RESIZE_DEBOUNCE_MS = 150
+
+# Progressive preview: an instant coarse render at a fraction of the preview size with nearest neighbour
+# interpolation, refined at the full preview size once the coefficients stop changing for REFINE_DELAY_MS
+COARSE_SCALES = (0.5, 0.25, 0.125)
+REFINE_INTERPOLATIONS = (('&Bilinear', cv2.INTER_LINEAR), ('&Lanczos', cv2.INTER_LANCZOS4))
+REFINE_DELAY_MS = 40
 
 
 class LDCSimulatorWindow(QMainWindow, Ui_MainWindow):
-    def __init__(self, parent=None):
+    # Emitted from the export thread, delivered to the UI thread through queued connections
+    export_progress = pyqtSignal(float, str)
+    export_finished = pyqtSignal(object, object)
+    sweep_finished = pyqtSignal(object, object)
+    autofit_finished = pyqtSignal(object, object)
+
+    def __init__(self, parent=None, startup_timer=None):
         super(LDCSimulatorWindow, self).__init__(parent)
         self.setupUi(self)
         self.setWindowTitle('{} ({})'.format(self.windowTitle(), version))
@@ -58,12 +65,62 @@ class LDCSimulatorWindow(QMainWindow, Ui_MainWindow):
         self.actionSave_As.triggered.connect(self.menu_save_as)
         self.actionCopy_parameters.triggered.connect(self.menu_copy_parameters)
 
+        # Video streaming menu items
+        self.actionOpen_video = QAction('Open &video', self)
+        self.actionStop_video = QAction('Stop video', self)
+        self.menuFile.insertAction(self.action_Save, self.actionOpen_video)
+        self.menuFile.insertAction(self.action_Save, self.actionStop_video)
+        self.actionOpen_video.triggered.connect(self.menu_open_video)
+        self.actionStop_video.triggered.connect(self.stop_stream)
+        self.actionStop_video.setEnabled(False)
+
+        # Project files holding lens profiles
+        self.actionOpen_project = QAction('Open &project...', self)
+        self.actionSave_project = QAction('Save pro&ject...', self)
+        self.menuFile.insertAction(self.action_Save, self.actionOpen_project)
+        self.menuFile.insertAction(self.action_Save, self.actionSave_project)
+        self.actionOpen_project.triggered.connect(self.menu_open_project)
+        self.actionSave_project.triggered.connect(self.menu_save_project)
+        self.project = LensProject()
+        self.project_path = None
+        # Lens profile in use, opening an image of its sensor size keeps the coefficients
+        self.profile = None
+
+        # Remap table export menu item
+        self.actionExport_maps = QAction('Export &remap tables...', self)
+        self.menuFile.insertAction(self.actionExit, self.actionExport_maps)
+        self.actionExport_maps.triggered.connect(self.menu_export_maps)
+        self.actionExport_maps.setEnabled(False)
+
+        # Sweep ranges of the last run and the window showing its contact sheet
+        self.sweep_ranges = None
+        self.sweep_dialog = None
+        self.autofit_img = None
+
+        # Linear or logarithmic slider positions, and the slider units each slider is centered on in fine mode
+        self.slider_scale = SliderScale()
+        self.slider_centers = dict.fromkeys(('k1', 'k2', 'k3', 'p1', 'p2'), 0.0)
+
+        # Opt-in stage timings of the display pipeline, also enabled by the LDC_PROFILE environment variable
+        self.profiler = FrameProfiler(enabled=bool(os.environ.get('LDC_PROFILE')))
+
         # Image data
+        self.image_path = None
         self.img = None  # original
-        self.img_undist = None  # un-distortion (modified)
+        self.img_preview = None  # original downscaled to the label size
 
         # Save image data path
         self.save_path = None
+        self.save_lossless = False
+
+        # Images and remap tables are written on a background thread
+        self.exporter = Exporter()
+        # Sweeps and auto-fit run on their own thread, a save never waits behind them
+        self.tool_runner = Exporter()
+        self.export_progress.connect(self.show_export_progress)
+        self.export_finished.connect(self.finish_export)
+        self.sweep_finished.connect(self.show_sweep_result)
+        self.autofit_finished.connect(self.apply_auto_fit)
 
         # Distortion coefficients
         self.dist_coeff = DistortionCoefficients()
@@ -71,21 +128,68 @@ class LDCSimulatorWindow(QMainWindow, Ui_MainWindow):
         # Camera focal length for OpenCV
         self.focal_length = 10.0
 
+        # Cached un-distortion remap tables of the previews and the stream, these stay in memory
+        self.remap_engine = RemapEngine()
+        # Tables of saved and exported images are also kept on disk, the next save of this lens reads them back
+        self.export_engine = RemapEngine(256 * 1024 * 1024, disk_cache=MapCache())
+
+        # Previews are rendered on a worker thread, only the latest request is computed
+        self.render_scheduler = RenderScheduler(self)
+        self.render_scheduler.rendered.connect(self.display_image)
+
+        # Scaled original / undistorted pixmaps and the grid overlay, cosmetic changes only re-composite
+        self.render_cache = RenderCache()
+        self.displayed_key = None
+
+        # Reused output buffers of the render thread, remap results and their label sized copies
+        self.remap_buffers = BufferRing()
+        self.display_buffers = BufferRing()
+
+        # While resizing the last pixmap is only rescaled, the preview is re-rendered once resizing settles
+        self.resize_timer = QTimer(self)
+        self.resize_timer.setSingleShot(True)
+        self.resize_timer.setInterval(RESIZE_DEBOUNCE_MS)
+        self.resize_timer.timeout.connect(self.show_image)
+
+        # Coarse preview while the coefficients change, the full quality render once they settle
+        self.progressive = True
+        self.coarse_scale = 0.25
+        self.refine_interpolation = cv2.INTER_LINEAR
+        self.refine_timer = QTimer(self)
+        self.refine_timer.setSingleShot(True)
+        self.refine_timer.setInterval(REFINE_DELAY_MS)
+        self.refine_timer.timeout.connect(self.refine_image)
+
+        # Let the layout shrink the label below the size of the pixmap it shows
+        self.label_image.setMinimumSize(1, 1)
+
+        # Zoomed view of part of the image, None while the whole image is fitted to the label. Only the visible
+        # tiles are undistorted, at the zoomed resolution, and kept while panning.
+        self.viewport = None
+        self.viewport_renderer = ViewportRenderer()
+        self.pan_position = None
+
+        # Running video stream and its fps / stage timings refresh
+        self.stream = None
+        self.stream_timer = QTimer(self)
+        self.stream_timer.setInterval(500)
+        self.stream_timer.timeout.connect(self.update_stream_status)
+
         self.show_grids = False
         self.grid_division = self.spinBox_division.value()
         self.grid_color = QColor(255, 0, 0)
 
         # The maximum and minimum value of each slider bars
-        self.horizontalSlider_k1.setMaximum(500)
-        self.horizontalSlider_k2.setMaximum(500)
-        self.horizontalSlider_k3.setMaximum(500)
-        self.horizontalSlider_p1.setMaximum(500)
-        self.horizontalSlider_p2.setMaximum(500)
-        self.horizontalSlider_k1.setMinimum(-500)
-        self.horizontalSlider_k2.setMinimum(-500)
-        self.horizontalSlider_k3.setMinimum(-500)
-        self.horizontalSlider_p1.setMinimum(-500)
-        self.horizontalSlider_p2.setMinimum(-500)
+        self.horizontalSlider_k1.setMaximum(SLIDER_RANGE)
+        self.horizontalSlider_k2.setMaximum(SLIDER_RANGE)
+        self.horizontalSlider_k3.setMaximum(SLIDER_RANGE)
+        self.horizontalSlider_p1.setMaximum(SLIDER_RANGE)
+        self.horizontalSlider_p2.setMaximum(SLIDER_RANGE)
+        self.horizontalSlider_k1.setMinimum(-SLIDER_RANGE)
+        self.horizontalSlider_k2.setMinimum(-SLIDER_RANGE)
+        self.horizontalSlider_k3.setMinimum(-SLIDER_RANGE)
+        self.horizontalSlider_p1.setMinimum(-SLIDER_RANGE)
+        self.horizontalSlider_p2.setMinimum(-SLIDER_RANGE)
 
         self.update_distortion_parameters_ui()
 
@@ -96,6 +200,17 @@ class LDCSimulatorWindow(QMainWindow, Ui_MainWindow):
         self.horizontalSlider_p1.valueChanged.connect(self.value_change_p1)
         self.horizontalSlider_p2.valueChanged.connect(self.value_change_p2)
 
+        # The line edits take exact coefficient values, applied with one render when editing finishes
+        # Only numbers in the C locale can be typed, float() parses the text
+        validator = QDoubleValidator(self)
+        validator.setNotation(QDoubleValidator.Notation.ScientificNotation)
+        validator.setLocale(QLocale.c())
+        for name in ('k1', 'k2', 'k3', 'p1', 'p2'):
+            getattr(self, 'lineEdit_' + name).setValidator(validator)
+            getattr(self, 'lineEdit_' + name).editingFinished.connect(partial(self.edit_coefficient, name))
+            # Fine mode sliders jump back to the middle when released, so they can be dragged on and on
+            getattr(self, 'horizontalSlider_' + name).sliderReleased.connect(partial(self.recenter_slider, name))
+
         # Disable distortion parameters panel at startup
         self.groupBox_distortion.setEnabled(False)
 
@@ -109,22 +224,217 @@ class LDCSimulatorWindow(QMainWindow, Ui_MainWindow):
         self.radioButton_blue.toggled.connect(self.change_grid_color)
         self.label_image.mousePressEvent = self.label_mouse_press
         self.label_image.mouseReleaseEvent = self.label_mouse_release
+        self.label_image.mouseMoveEvent = self.label_mouse_move
+        self.label_image.wheelEvent = self.label_wheel
+
+        # The Tool menu is only needed once the window is up, it is built right after the first paint
+        self.startup_timer = startup_timer
+        self.first_painted = False
+        if self.startup_timer is not None:
+            self.startup_timer.mark('window')
+
+    def paintEvent(self, event):
+        super(LDCSimulatorWindow, self).paintEvent(event)
+        if not self.first_painted:
+            self.first_painted = True
+            if self.startup_timer is not None:
+                self.startup_timer.mark('first paint')
+            QTimer.singleShot(0, self.finish_startup)
+
+    def finish_startup(self):
+        self.setup_tool_menus()
+        if self.startup_timer is not None:
+            self.startup_timer.mark('tool menus')
+            print(self.startup_timer.get_report())
+            QApplication.instance().quit()
+
+    def setup_tool_menus(self):
+        # Automatic coefficient fitting menu item
+        self.actionAuto_fit = QAction('&Auto-fit coefficients', self)
+        self.actionAuto_fit.setShortcut('Ctrl+F')
+        self.menu_Tool.addAction(self.actionAuto_fit)
+        self.actionAuto_fit.triggered.connect(self.menu_auto_fit)
+        self.actionAuto_fit.setEnabled(False)
+
+        # Parameter sweep contact sheet menu item
+        self.actionSweep = QAction('Parameter &sweep...', self)
+        self.menu_Tool.addAction(self.actionSweep)
+        self.actionSweep.triggered.connect(self.menu_parameter_sweep)
+        self.actionSweep.setEnabled(False)
+
+        # Distortion model menu, one checkable item per model and the editor of the coefficients without a slider
+        self.menuModel = self.menu_Tool.addMenu('Distortion &model')
+        self.model_actions = QActionGroup(self)
+        for model in MODELS.values():
+            action = QAction(model.title, self)
+            action.setCheckable(True)
+            action.setChecked(model.name == 'standard')
+            action.triggered.connect(partial(self.menu_select_model, model.name))
+            self.model_actions.addAction(action)
+            self.menuModel.addAction(action)
+        self.actionModel_coefficients = QAction('Model &coefficients...', self)
+        self.menuModel.addSeparator()
+        self.menuModel.addAction(self.actionModel_coefficients)
+        self.actionModel_coefficients.triggered.connect(self.menu_model_coefficients)
+        self.actionModel_coefficients.setEnabled(False)
+
+        # Slider scale menu, linear or logarithmic positions and a fine mode around the current values
+        self.menuSlider_scale = self.menu_Tool.addMenu('Slider &scale')
+        self.slider_scale_actions = QActionGroup(self)
+        for scale, title in zip(SCALES, ('&Linear', 'Lo&garithmic')):
+            action = QAction(title, self)
+            action.setCheckable(True)
+            action.setChecked(scale == 'linear')
+            action.triggered.connect(partial(self.menu_slider_scale, scale))
+            self.slider_scale_actions.addAction(action)
+            self.menuSlider_scale.addAction(action)
+        self.actionFine_sliders = QAction('&Fine adjustment', self)
+        self.actionFine_sliders.setCheckable(True)
+        self.actionFine_sliders.setShortcut('Ctrl+Shift+F')
+        self.menuSlider_scale.addSeparator()
+        self.menuSlider_scale.addAction(self.actionFine_sliders)
+        self.actionFine_sliders.toggled.connect(self.menu_fine_sliders)
+
+        # Profiles of the open project
+        self.menuProfiles = self.menu_Tool.addMenu('Lens &profiles')
+        self.menuProfiles.setEnabled(False)
+
+        # Stage timings overlay and trace export
+        self.actionProfiling = QAction('&Profiling overlay', self)
+        self.actionProfiling.setCheckable(True)
+        self.actionProfiling.setChecked(self.profiler.enabled)
+        self.actionSave_trace = QAction('Save profiling &trace...', self)
+        self.menu_Tool.addSeparator()
+        self.menu_Tool.addAction(self.actionProfiling)
+        self.menu_Tool.addAction(self.actionSave_trace)
+        self.actionProfiling.toggled.connect(self.menu_toggle_profiling)
+        self.actionSave_trace.triggered.connect(self.menu_save_trace)
+
+        # Progressive preview settings
+        self.menuProgressive = self.menu_Tool.addMenu('Progressive pre&view')
+        self.actionProgressive = QAction('&Enabled', self)
+        self.actionProgressive.setCheckable(True)
+        self.actionProgressive.setChecked(self.progressive)
+        self.actionProgressive.toggled.connect(self.menu_toggle_progressive)
+        self.menuProgressive.addAction(self.actionProgressive)
+        self.menuProgressive.addSeparator()
+        self.coarse_scale_actions = QActionGroup(self)
+        for coarse_scale in COARSE_SCALES:
+            action = QAction('Coarse level 1/{:d}'.format(int(round(1 / coarse_scale))), self)
+            action.setCheckable(True)
+            action.setChecked(coarse_scale == self.coarse_scale)
+            action.triggered.connect(partial(self.menu_coarse_scale, coarse_scale))
+            self.coarse_scale_actions.addAction(action)
+            self.menuProgressive.addAction(action)
+        self.menuProgressive.addSeparator()
+        self.refine_interpolation_actions = QActionGroup(self)
+        for title, interpolation in REFINE_INTERPOLATIONS:
+            action = QAction('Refine with {}'.format(title), self)
+            action.setCheckable(True)
+            action.setChecked(interpolation == self.refine_interpolation)
+            action.triggered.connect(partial(self.menu_refine_interpolation, interpolation))
+            self.refine_interpolation_actions.addAction(action)
+            self.menuProgressive.addAction(action)
+        self.actionRefine_delay = QAction('Refine &delay...', self)
+        self.actionRefine_delay.triggered.connect(self.menu_refine_delay)
+        self.menuProgressive.addAction(self.actionRefine_delay)
+
+        # Zoom and pan, also with the mouse wheel and by dragging the image
+        self.menuZoom = self.menu_Tool.addMenu('&Zoom')
+        for title, shortcut, slot in (('Zoom &in', 'Ctrl+=', self.menu_zoom_in),
+                                      ('Zoom &out', 'Ctrl+-', self.menu_zoom_out),
+                                      ('&Actual size', 'Ctrl+1', self.menu_actual_size),
+                                      ('&Fit to window', 'Ctrl+0', self.menu_fit_to_window)):
+            action = QAction(title, self)
+            action.setShortcut(shortcut)
+            action.triggered.connect(slot)
+            self.menuZoom.addAction(action)
 
     def label_mouse_press(self, event: QMouseEvent):
         if event.button() == Qt.MouseButton.RightButton:
             self.show_image(show_org=True)
+        elif event.button() == Qt.MouseButton.LeftButton and self.viewport is not None:
+            self.pan_position = event.position()
 
     def label_mouse_release(self, event: QMouseEvent):
         if event.button() == Qt.MouseButton.RightButton:
             self.show_image()
+        elif event.button() == Qt.MouseButton.LeftButton:
+            self.pan_position = None
+
+    def label_mouse_move(self, event: QMouseEvent):
+        if self.pan_position is None or self.viewport is None:
+            return
+        delta = event.position() - self.pan_position
+        self.pan_position = event.position()
+        self.viewport.pan(delta.x(), delta.y(), self.label_image.width(), self.label_image.height())
+        self.show_image()
+
+    def label_wheel(self, event):
+        steps = event.angleDelta().y() // 120
+        if steps:
+            self.zoom_view(steps, event.position().x(), event.position().y())
+
+    def zoom_view(self, steps, x=None, y=None):
+        # Zooms by whole levels around the view position (x, y), the label center by default
+        if self.img is None or self.stream is not None:
+            return
+        lw, lh = self.label_image.width(), self.label_image.height()
+        x = lw / 2.0 if x is None else x
+        y = lh / 2.0 if y is None else y
+        height, width = self.img.shape[:2]
+        fit_level = get_fit_level(self.get_fit_size()[0] / width)
+        if self.viewport is None:
+            if steps < 0:
+                return
+            # Zooming in from the fitted image, whose pixmap is centered in the label
+            fit_width, fit_height = self.get_fit_size()
+            scale = width / fit_width
+            image_x, image_y = (x - (lw - fit_width) / 2.0) * scale, (y - (lh - fit_height) / 2.0) * scale
+            self.viewport = Viewport(width, height, fit_level + steps - 1)
+            self.viewport.center = (image_x - (x - lw / 2.0) / self.viewport.zoom,
+                                    image_y - (y - lh / 2.0) / self.viewport.zoom)
+            self.viewport.clamp(lw, lh)
+        elif self.viewport.level + steps < fit_level:
+            self.menu_fit_to_window()
+            return
+        else:
+            self.viewport.zoom_at(self.viewport.level + steps, x, y, lw, lh)
+        self.statusbar.showMessage('Zoom {:.0f}%'.format(self.viewport.zoom * 100.0))
+        self.show_image()
+
+    def menu_zoom_in(self):
+        self.zoom_view(1)
+
+    def menu_zoom_out(self):
+        self.zoom_view(-1)
+
+    def menu_actual_size(self):
+        if self.img is None or self.stream is not None:
+            return
+        if self.viewport is None:
+            height, width = self.img.shape[:2]
+            self.viewport = Viewport(width, height)
+        self.viewport.zoom_at(0, self.label_image.width() / 2.0, self.label_image.height() / 2.0,
+                              self.label_image.width(), self.label_image.height())
+        self.statusbar.showMessage('Zoom 100%')
+        self.show_image()
+
+    def menu_fit_to_window(self):
+        if self.viewport is None:
+            return
+        self.viewport = None
+        self.pan_position = None
+        self.statusbar.clearMessage()
+        self.show_image()
 
     def selected_show_grids(self):
         self.show_grids = self.groupBox_show_grids.isChecked()
-        self.show_image()
+        self.refresh_overlay()
 
     def change_grid_division(self):
         self.grid_division = self.spinBox_division.value()
-        self.show_image()
+        self.refresh_overlay()
 
     def change_grid_color(self):
         btn = self.sender()
@@ -135,53 +445,73 @@ class LDCSimulatorWindow(QMainWindow, Ui_MainWindow):
                 self.grid_color = QColor(0, 255, 0)
             elif btn.text() == 'Blue':
                 self.grid_color = QColor(0, 0, 255)
-        self.show_image()
+        self.refresh_overlay()
 
     def value_change_k1(self):
-        self.dist_coeff.k1 = self.horizontalSlider_k1.value() * self.dist_coeff.step_k1
-        self.lineEdit_k1.setText(str(self.horizontalSlider_k1.value()))
-        self.show_image()
+        self.slider_moved('k1')
 
     def value_change_k2(self):
-        self.dist_coeff.k2 = self.horizontalSlider_k2.value() * self.dist_coeff.step_k2
-        self.lineEdit_k2.setText(str(self.horizontalSlider_k2.value()))
-        self.show_image()
+        self.slider_moved('k2')
 
     def value_change_k3(self):
-        self.dist_coeff.k3 = self.horizontalSlider_k3.value() * self.dist_coeff.step_k3
-        self.lineEdit_k3.setText(str(self.horizontalSlider_k3.value()))
-        self.show_image()
+        self.slider_moved('k3')
 
     def value_change_p1(self):
-        self.dist_coeff.p1 = self.horizontalSlider_p1.value() * self.dist_coeff.step_p1
-        self.lineEdit_p1.setText(str(self.horizontalSlider_p1.value()))
-        self.show_image()
+        self.slider_moved('p1')
 
     def value_change_p2(self):
-        self.dist_coeff.p2 = self.horizontalSlider_p2.value() * self.dist_coeff.step_p2
-        self.lineEdit_p2.setText(str(self.horizontalSlider_p2.value()))
+        self.slider_moved('p2')
+
+    def slider_moved(self, name):
+        position = getattr(self, 'horizontalSlider_' + name).value()
+        units = self.slider_scale.to_units(position, self.slider_centers[name])
+        value = units * getattr(self.dist_coeff, 'step_' + name)
+        setattr(self.dist_coeff, name, value)
+        getattr(self, 'lineEdit_' + name).setText(format_coefficient(value))
         self.show_image()
 
-    def update_distortion_parameters_ui(self):
-        val = int((self.dist_coeff.k1 / self.dist_coeff.step_k1))
-        self.horizontalSlider_k1.setValue(val)
-        self.lineEdit_k1.setText(str(val))
+    def edit_coefficient(self, name):
+        line_edit = getattr(self, 'lineEdit_' + name)
+        try:
+            value = float(line_edit.text())
+            if not math.isfinite(value):
+                raise ValueError('Coefficients must be finite')
+        except ValueError:
+            # Restore the current value
+            line_edit.setText(format_coefficient(getattr(self.dist_coeff, name)))
+            return
+        if value == getattr(self.dist_coeff, name):
+            return
+        setattr(self.dist_coeff, name, value)
+        self.update_distortion_parameters_ui()
+        self.show_image()
 
-        val = int((self.dist_coeff.k2 / self.dist_coeff.step_k2))
-        self.horizontalSlider_k2.setValue(val)
-        self.lineEdit_k2.setText(str(val))
+    def recenter_slider(self, name):
+        if self.slider_scale.fine:
+            self.update_slider(name)
 
-        val = int((self.dist_coeff.k3 / self.dist_coeff.step_k3))
-        self.horizontalSlider_k3.setValue(val)
-        self.lineEdit_k3.setText(str(val))
+    def update_slider(self, name):
+        # Moves the slider to the coefficient without feeding the quantized position back into it
+        units = getattr(self.dist_coeff, name) / getattr(self.dist_coeff, 'step_' + name)
+        if self.slider_scale.fine:
+            self.slider_centers[name] = units
+        slider = getattr(self, 'horizontalSlider_' + name)
+        slider.blockSignals(True)
+        slider.setValue(self.slider_scale.to_position(units, self.slider_centers[name]))
+        slider.blockSignals(False)
 
-        val = int((self.dist_coeff.p1 / self.dist_coeff.step_p1))
-        self.horizontalSlider_p1.setValue(val)
-        self.lineEdit_p1.setText(str(val))
+    def update_distortion_parameters_ui(self):
+        for name in ('k1', 'k2', 'k3', 'p1', 'p2'):
+            self.update_slider(name)
+            getattr(self, 'lineEdit_' + name).setText(format_coefficient(getattr(self.dist_coeff, name)))
 
-        val = int((self.dist_coeff.p2 / self.dist_coeff.step_p2))
-        self.horizontalSlider_p2.setValue(val)
-        self.lineEdit_p2.setText(str(val))
+    def menu_slider_scale(self, scale):
+        self.slider_scale.scale = scale
+        self.update_distortion_parameters_ui()
+
+    def menu_fine_sliders(self, checked):
+        self.slider_scale.fine = checked
+        self.update_distortion_parameters_ui()
 
     def reset_all_parameters(self):
         self.dist_coeff.reset()
@@ -190,80 +520,436 @@ class LDCSimulatorWindow(QMainWindow, Ui_MainWindow):
     def menu_open_image(self):
         # Popup open file dialog
         path, _ = QFileDialog.getOpenFileNames(self, 'Open an image', '',
-                                               'Images (*.jpg *.jpeg *.png *.bmp);;All Files (*.*)')
+                                               'Images (*.jpg *.jpeg *.png *.bmp *.npy);;All Files (*.*)')
         if path:
-            filename = Path(path[0])
-            try:
-                # Reset all parameters before a new image open
-                self.reset_all_parameters()
+            self.open_image(path[0])
 
+    def open_image(self, filename):
+        self.stop_stream()
+        filename = Path(filename)
+        try:
+            if filename.suffix.lower() == '.npy':
+                # Memory-map huge images saved as NumPy arrays instead of loading them
+                self.img = np.load(filename, mmap_mode='r')
+            else:
                 # Load image data through OpenCV
                 self.img = cv2.imdecode(np.fromfile(filename, dtype=np.uint8), cv2.IMREAD_COLOR)
+            self.image_path = filename
+
+            height, width = self.img.shape[:2]
+            if self.profile is None or not self.profile.matches_size(width, height):
+                # Reset all parameters before a new image open, unless it comes from the lens profile's sensor
+                self.profile = None
+                self.reset_all_parameters()
+            self.remap_engine.clear()
+            self.export_engine.clear()
+            self.img_preview = None
+            self.render_cache.clear()
+            self.remap_buffers.clear()
+            self.display_buffers.clear()
+            self.viewport = None
+            self.viewport_renderer.set_image(self.img)
+        except Exception as e:
+            print(e)
+
+        # Show image on windows
+        self.show_image()
+
+        # Enable distortion parameters panel
+        self.groupBox_distortion.setEnabled(True)
+        self.action_Save.setEnabled(True)
+        self.actionSave_As.setEnabled(True)
+        self.actionAuto_fit.setEnabled(self.dist_coeff.model == 'standard' and self.autofit_img is None)
+        self.actionSweep.setEnabled(True)
+        self.actionExport_maps.setEnabled(True)
+
+    def menu_open_project(self):
+        path, _ = QFileDialog.getOpenFileName(self, 'Open a project', '', ';;'.join(PROJECT_FILTERS))
+        if not path:
+            return
+        try:
+            project = LensProject.load(path)
+        except (OSError, ValueError) as e:
+            self.statusbar.showMessage('Cannot open project: {}'.format(e))
+            return
+        self.project = project
+        self.project_path = path
+        self.update_profiles_menu()
+
+        profile = project.get_profile()
+        if profile is not None:
+            self.apply_profile(profile)
+        if project.image is not None and Path(project.image).is_file():
+            # The profile matches the image it was saved with, so opening it keeps the coefficients
+            self.open_image(project.image)
+
+    def menu_save_project(self):
+        name = self.profile.name if self.profile is not None else (self.image_path.stem if self.image_path else '')
+        name, ok = QInputDialog.getText(self, 'Save project', 'Lens profile name', text=name)
+        if not ok:
+            return
+        path, _ = QFileDialog.getSaveFileName(self, 'Save project', self.project_path or 'lens.ldc',
+                                              ';;'.join(PROJECT_FILTERS))
+        if not path:
+            return
+
+        width, height = (self.img.shape[1], self.img.shape[0]) if self.img is not None else (None, None)
+        self.profile = LensProfile.from_coefficients(self.dist_coeff, self.focal_length, width, height, name)
+        self.project.set_profile(self.profile)
+        self.project.image = str(self.image_path) if self.image_path is not None else None
+        try:
+            self.project.save(path)
+        except OSError as e:
+            self.statusbar.showMessage('Cannot save project: {}'.format(e))
+            return
+        self.project_path = path
+        self.update_profiles_menu()
+        self.statusbar.showMessage('Saved {}'.format(path))
+
+    def update_profiles_menu(self):
+        self.menuProfiles.clear()
+        for profile in self.project.profiles:
+            action = QAction(str(profile), self)
+            action.triggered.connect(partial(self.apply_profile, profile))
+            self.menuProfiles.addAction(action)
+        self.menuProfiles.setEnabled(bool(self.project.profiles))
+
+    def apply_profile(self, profile):
+        profile.apply(self.dist_coeff)
+        self.focal_length = profile.focal_length
+        self.profile = profile
+        self.update_model_ui()
+        self.update_distortion_parameters_ui()
+        self.show_image()
+        self.statusbar.showMessage('Lens profile {}'.format(profile))
+
+    def menu_open_video(self):
+        # Popup open file dialog
+        path, _ = QFileDialog.getOpenFileName(self, 'Open a video', '',
+                                              'Videos (*.mp4 *.avi *.mov *.mkv);;All Files (*.*)')
+        if path:
+            from stream import StreamPipeline, CallbackSink, open_source
+            self.stop_stream()
+            # Frames are shown whole
+            self.viewport = None
+            try:
+                source = open_source(path)
             except Exception as e:
                 print(e)
+                return
 
-            # Show image on windows
-            self.show_image()
+            # Frames are undistorted at the label size, the preview goes through the render scheduler
+            self.stream = StreamPipeline(source, CallbackSink(self.show_stream_frame, source.fps),
+                                         self.dist_coeff.get_distortion_coefficients(), self.focal_length,
+                                         preview_size=(self.label_image.width(), self.label_image.height()),
+                                         remap_engine=self.remap_engine, model=self.dist_coeff.model)
+            self.stream.start()
+            self.stream_timer.start()
 
-            # Enable distortion parameters panel
             self.groupBox_distortion.setEnabled(True)
-            self.action_Save.setEnabled(True)
-            self.actionSave_As.setEnabled(True)
+            self.actionStop_video.setEnabled(True)
+
+    def show_stream_frame(self, frame):
+        # Called on the stream encode thread
+        self.render_scheduler.submit(partial(self.render_qimage, None, partial(np.asarray, frame),
+                                             self.profiler.begin()))
+
+    def update_stream_status(self):
+        if self.stream is None:
+            return
+        self.statusbar.showMessage(self.stream.get_status_text())
+        if not self.stream.is_running():
+            self.stop_stream()
+
+    def stop_stream(self):
+        if self.stream is not None:
+            self.stream.stop()
+            try:
+                self.stream.wait()
+                self.statusbar.showMessage('{} frames, {}'.format(self.stream.frames,
+                                                                  self.stream.get_status_text()))
+            except Exception as e:
+                self.statusbar.showMessage('Video stopped after {} frames: {}'.format(self.stream.frames, e))
+            self.stream = None
+        self.stream_timer.stop()
+        self.actionStop_video.setEnabled(False)
 
     def show_image(self, show_org=False):
-        img = self.img
-        if img is not None:
-            h, w, d = img.shape
+        if self.stream is not None:
+            # The running stream picks up the new coefficients from its next frame
+            self.stream.set_coefficients(self.dist_coeff.get_distortion_coefficients(), self.dist_coeff.model)
+            return
+
+        if self.img is not None:
+            if show_org:
+                # A pending refinement would replace the original while the right button is held
+                self.refine_timer.stop()
+            if self.viewport is not None:
+                # Tiles are cached by the viewport renderer, the composed view is shown once and not cached
+                self.refine_timer.stop()
+                frame = self.profiler.begin()
+                self.render_scheduler.submit(partial(self.render_qimage, None, self.get_viewport_job(show_org), frame))
+                return
+
+            key = self.get_render_key(show_org)
+            if key in self.render_cache:
+                # Already rendered for these coefficients and label size, drop any render still in flight
+                self.refine_timer.stop()
+                self.render_scheduler.cancel()
+                frame = self.profiler.begin()
+                self.display_layer(key, frame)
+                self.end_profiled_frame(frame)
+                return
+
+            frame = self.profiler.begin()
+            img, scale = self.get_preview_image()
+
+            if not show_org and self.progressive:
+                # Instant coarse preview, shown once and not cached, the refinement follows when input settles
+                height, width = img.shape[:2]
+                coarse = cv2.resize(img, (max(1, int(width * self.coarse_scale)),
+                                          max(1, int(height * self.coarse_scale))), interpolation=cv2.INTER_NEAREST)
+                job = self.get_undistort_job(coarse, scale * coarse.shape[1] / width, cv2.INTER_NEAREST)
+                self.render_scheduler.submit(partial(self.render_qimage, None, job, frame, self.get_fit_size(),
+                                                     cv2.INTER_NEAREST))
+                self.refine_timer.start()
+                return
 
             if not show_org:
-                # Calculate OpenCV un-distortion
-                self.calculate_undistortion(img)
-                data = self.img_undist.data
+                job = self.get_undistort_job(img, scale, self.refine_interpolation)
             else:
-                data = self.img.data
-
-            # Convert ndarray to QT image
-            q_img = QImage(data, w, h, w * d, QImage.Format.Format_BGR888)
-            lh = self.label_image.height()
-            lw = self.label_image.width()
-
-            # Create pixmap
-            pixmap = QPixmap.fromImage(q_img).scaled(lw, lh, Qt.AspectRatioMode.KeepAspectRatio)
-
-            if self.show_grids:
-                # Draw grids
-                painter = QPainter(pixmap)
-                pen_color = self.grid_color
-                pen_width = 1
-                div = self.grid_division
-
-                pen = QPen(pen_color, pen_width)
-                painter.setPen(pen)
-                for i in range(1, div):
-                    painter.drawLine(0, int(i * pixmap.height() / div), pixmap.width(), int(i * pixmap.height() / div))
-                    painter.drawLine(int(i * pixmap.width() / div), 0, int(i * pixmap.width() / div), pixmap.height())
-                painter.end()
-
-            # Show image on QLabel
+                job = partial(np.asarray, img)
+            self.render_scheduler.submit(partial(self.render_qimage, key, job, frame, self.get_fit_size()))
+
+    def refine_image(self):
+        # The coefficients settled, render the full quality preview unless it is cached meanwhile
+        if self.img is None or self.stream is not None or self.viewport is not None:
+            return
+        key = self.get_render_key()
+        frame = self.profiler.begin()
+        if key in self.render_cache:
+            self.display_layer(key, frame)
+            self.end_profiled_frame(frame)
+            return
+        img, scale = self.get_preview_image()
+        job = self.get_undistort_job(img, scale, self.refine_interpolation)
+        self.render_scheduler.submit(partial(self.render_qimage, key, job, frame, self.get_fit_size()))
+
+    def get_undistort_job(self, img, scale, interpolation):
+        # Snapshot the current coefficients, OpenCV un-distortion runs on the worker thread
+        height, width = img.shape[:2]
+        camera_matrix = self.get_camera_matrix(width, height, scale)
+        distortion_coefficients = self.dist_coeff.get_distortion_coefficients()
+        return partial(self.undistort_preview, img, camera_matrix, distortion_coefficients, self.dist_coeff.model,
+                       interpolation)
+
+    def undistort_preview(self, img, camera_matrix, distortion_coefficients, model, interpolation):
+        # Runs on the render thread, skipped when newer coefficients came in before it started
+        if self.render_scheduler.is_stale():
+            return None
+        return self.remap_engine.undistort(img, camera_matrix, distortion_coefficients, model, interpolation,
+                                           dst=self.remap_buffers.next(img.shape, img.dtype))
+
+    def get_viewport_job(self, show_org=False):
+        # The original is the same view without distortion
+        if show_org:
+            model, distortion_coefficients = 'standard', np.zeros((5, 1))
+        else:
+            model, distortion_coefficients = self.dist_coeff.model, self.dist_coeff.get_distortion_coefficients()
+        return partial(self.render_viewport, copy.copy(self.viewport), self.label_image.width(),
+                       self.label_image.height(), model, distortion_coefficients, self.focal_length,
+                       self.refine_interpolation)
+
+    def render_viewport(self, viewport, width, height, model, distortion_coefficients, focal_length, interpolation):
+        # Runs on the render thread
+        if self.render_scheduler.is_stale():
+            return None
+        return self.viewport_renderer.render(viewport, width, height, model, distortion_coefficients, focal_length,
+                                             interpolation, dst=self.display_buffers.next((height, width, 3)))
+
+    def get_fit_size(self):
+        # Size of the image scaled into the label keeping its aspect ratio
+        height, width = self.img.shape[:2]
+        scale = min(self.label_image.width() / width, self.label_image.height() / height)
+        return max(1, int(round(width * scale))), max(1, int(round(height * scale)))
+
+    def get_render_key(self, show_org=False):
+        size = (self.label_image.width(), self.label_image.height())
+        if show_org:
+            return ('original',) + size
+        return ('undistorted', self.dist_coeff.model, self.dist_coeff.get_distortion_coefficients().tobytes(),
+                self.focal_length, self.refine_interpolation) + size
+
+    def render_qimage(self, key, job, frame, fit_size=None, interpolation=cv2.INTER_LINEAR):
+        with frame.stage('undistort'):
+            img = job()
+        if img is None:
+            return None
+
+        if fit_size is not None and (img.shape[1], img.shape[0]) != tuple(fit_size):
+            # Scaled by OpenCV into a reused buffer of the label size, Qt then only copies it into the pixmap
+            with frame.stage('scale'):
+                dst = self.display_buffers.next((fit_size[1], fit_size[0]) + img.shape[2:], img.dtype)
+                if fit_size[0] < img.shape[1]:
+                    interpolation = cv2.INTER_AREA
+                img = cv2.resize(img, tuple(fit_size), dst=dst, interpolation=interpolation)
+        h, w, d = img.shape
+
+        # Convert ndarray to QT image, the array is returned too so the buffer outlives the QImage
+        with frame.stage('qimage'):
+            q_img = QImage(img.data, w, h, img.strides[0], QImage.Format.Format_BGR888)
+        return key, q_img, img, frame
+
+    def display_image(self, generation, result):
+        if not self.render_scheduler.is_current(generation):
+            return
+        key, q_img, _, frame = result
+        lh = self.label_image.height()
+        lw = self.label_image.width()
+
+        # Create pixmap, the only copy of the rendered buffer
+        with frame.stage('pixmap'):
+            pixmap = QPixmap.fromImage(q_img)
+        if pixmap.width() != lw and pixmap.height() != lh or pixmap.width() > lw or pixmap.height() > lh:
+            # The label was resized while rendering, or a video frame at the size of the stream
+            with frame.stage('scale'):
+                pixmap = pixmap.scaled(lw, lh, Qt.AspectRatioMode.KeepAspectRatio)
+
+        if key is None:
+            # Video frames and coarse previews are shown once and never cached
+            self.displayed_key = None
+            with frame.stage('grid'):
+                pixmap = self.render_cache.compose(pixmap, self.show_grids, self.grid_division, self.grid_color)
+            with frame.stage('display'):
+                self.label_image.setPixmap(pixmap)
+        else:
+            self.render_cache.put(key, pixmap)
+            self.display_layer(key, frame)
+        self.end_profiled_frame(frame)
+
+    def display_layer(self, key, frame=None):
+        frame = frame if frame is not None else self.profiler.begin()
+        self.displayed_key = key
+        with frame.stage('grid'):
+            pixmap = self.render_cache.compose(self.render_cache.get(key), self.show_grids, self.grid_division,
+                                               self.grid_color)
+
+        # Show image on QLabel
+        with frame.stage('display'):
             self.label_image.setPixmap(pixmap)
 
-    def calculate_undistortion(self, img: np.ndarray):
-        height, width, depth = img.shape
+    def end_profiled_frame(self, frame):
+        if self.profiler.enabled:
+            self.profiler.end(frame)
+            if self.stream is None:
+                self.statusbar.showMessage(self.profiler.get_status_text())
+
+    def menu_toggle_progressive(self, checked):
+        self.progressive = checked
+        self.refine_timer.stop()
+        self.show_image()
+
+    def menu_coarse_scale(self, coarse_scale):
+        self.coarse_scale = coarse_scale
+
+    def menu_refine_interpolation(self, interpolation):
+        self.refine_interpolation = interpolation
+        self.show_image()
+
+    def menu_refine_delay(self):
+        delay, ok = QInputDialog.getInt(self, 'Refine delay', 'Milliseconds without changes before refining',
+                                        self.refine_timer.interval(), 0, 5000)
+        if ok:
+            self.refine_timer.setInterval(delay)
+
+    def menu_toggle_profiling(self, checked):
+        self.profiler.enabled = checked
+        if checked:
+            self.profiler.clear()
+            self.statusbar.showMessage(self.profiler.get_status_text())
+        else:
+            self.statusbar.clearMessage()
+
+    def menu_save_trace(self):
+        path, _ = QFileDialog.getSaveFileName(self, 'Save profiling trace', 'ldc_trace.json',
+                                              'Chrome trace (*.json)')
+        if path:
+            self.profiler.dump_trace(path)
+
+    def refresh_overlay(self):
+        # Grid changes only composite the cached layer with a new overlay
+        if self.displayed_key in self.render_cache:
+            self.display_layer(self.displayed_key)
+        else:
+            self.show_image()
+
+    def get_preview_image(self):
+        # Downscale the original image to the label size, never upscale
+        height, width = self.img.shape[:2]
+        scale = min(self.label_image.width() / width, self.label_image.height() / height, 1.0)
+        preview_width = max(1, int(round(width * scale)))
+        preview_height = max(1, int(round(height * scale)))
+
+        if self.img_preview is None or self.img_preview.shape[:2] != (preview_height, preview_width):
+            if scale < 1.0:
+                self.img_preview = cv2.resize(self.img, (preview_width, preview_height),
+                                              interpolation=cv2.INTER_AREA)
+            else:
+                self.img_preview = self.img
+        return self.img_preview, preview_width / width
+
+    def get_camera_matrix(self, width, height, scale=1.0):
+        return self.dist_coeff.get_model().get_camera_matrix(width, height, self.focal_length, scale)
+
+    def save_image(self):
+        # Snapshot the image and coefficients, un-distortion, encoding and writing run on the export thread
+        img = self.img
+        height, width = img.shape[:2]
         camera_matrix = self.get_camera_matrix(width, height)
         distortion_coefficients = self.dist_coeff.get_distortion_coefficients()
-        self.img_undist = cv2.undistort(img, camera_matrix, distortion_coefficients)
+        model = self.dist_coeff.model
+        if width * height > TILED_SAVE_PIXELS:
+            job = partial(self.export_tiled, self.save_path, img, camera_matrix, distortion_coefficients, model,
+                          self.save_lossless)
+        else:
+            job = partial(export_image, self.save_path,
+                          partial(self.export_engine.undistort, img, camera_matrix, distortion_coefficients, model),
+                          lossless=self.save_lossless, progress=self.export_progress.emit)
+        self.set_save_enabled(False)
+        self.exporter.submit(job, done=self.export_finished.emit)
 
-    def get_camera_matrix(self, width, height):
-        cam = np.eye(3, dtype=np.float32)
-        cam[0, 2] = width / 2.0
-        cam[1, 2] = height / 2.0
-        cam[0, 0] = self.focal_length
-        cam[1, 1] = self.focal_length
-        return cam
+    def export_tiled(self, path, img, camera_matrix, distortion_coefficients, model, lossless):
+        # Undistort tile by tile into a memory-mapped scratch file, full size maps are never built
+        from tiled import undistort_to_memmap
+        with tempfile.TemporaryDirectory() as tmp:
+            undistort = partial(undistort_to_memmap, img, camera_matrix, distortion_coefficients,
+                                Path(tmp) / 'undistorted.npy', model=model)
+            return export_image(path, undistort, lossless=lossless, progress=self.export_progress.emit)
 
-    def save_image(self):
-        encode_param = [int(cv2.IMWRITE_JPEG_QUALITY), 98]
-        cv2.imencode('.jpg', self.img_undist, encode_param)[1].tofile(self.save_path)
+    def export_maps(self, path, img, camera_matrix, distortion_coefficients, model):
+        height, width = img.shape[:2]
+        maps = self.export_engine.get_maps(camera_matrix, distortion_coefficients, width, height, model)
+        if hasattr(maps, 'expand'):
+            maps = maps.expand()
+        self.export_progress.emit(0.5, 'Writing remap tables')
+        save_maps(path, maps[0], maps[1], camera_matrix, distortion_coefficients)
+        self.export_progress.emit(1.0, 'Saved {}'.format(path))
+        return path
+
+    def show_export_progress(self, fraction, message):
+        self.statusbar.showMessage('{} ({:.0f}%)'.format(message, fraction * 100.0))
+
+    def finish_export(self, path, error):
+        self.set_save_enabled(self.img is not None)
+        if error is not None:
+            self.statusbar.showMessage('Save failed: {}'.format(error))
+        else:
+            self.statusbar.showMessage('Saved {}'.format(path))
+
+    def set_save_enabled(self, enabled):
+        self.action_Save.setEnabled(enabled)
+        self.actionSave_As.setEnabled(enabled)
+        self.actionExport_maps.setEnabled(enabled)
 
     def menu_save(self):
         if self.save_path is None:
@@ -272,27 +958,201 @@ class LDCSimulatorWindow(QMainWindow, Ui_MainWindow):
             self.save_image()
 
     def menu_save_as(self):
-        path, _ = QFileDialog.getSaveFileName(self, 'Save File As', '', 'Jpeg (*.jpg)')
+        path, selected_filter = QFileDialog.getSaveFileName(self, 'Save File As', '', ';;'.join(IMAGE_FILTERS))
         if path:
-            self.save_path = path
+            self.save_path = str(get_save_path(path, selected_filter))
+            self.save_lossless = is_lossless(self.save_path, selected_filter)
             self.save_image()
 
+    def menu_export_maps(self):
+        if self.img is None:
+            return
+        path, _ = QFileDialog.getSaveFileName(self, 'Export remap tables', 'remap.npz', ';;'.join(MAP_FILTERS))
+        if path:
+            height, width = self.img.shape[:2]
+            self.set_save_enabled(False)
+            self.exporter.submit(self.export_maps, path, self.img, self.get_camera_matrix(width, height),
+                                 self.dist_coeff.get_distortion_coefficients(), self.dist_coeff.model,
+                                 done=self.export_finished.emit)
+
+    def menu_auto_fit(self):
+        if self.img is None or self.dist_coeff.model != 'standard':
+            return
+        from autofit import fit_coefficients
+        # Detection and fitting run on the tool thread, the result is applied if the image is still shown
+        self.autofit_img = self.img
+        self.actionAuto_fit.setEnabled(False)
+        self.statusbar.showMessage('Auto-fit: searching for a checkerboard or straight lines')
+        self.tool_runner.submit(fit_coefficients, self.img, self.focal_length, copy.copy(self.dist_coeff),
+                                done=self.autofit_finished.emit)
+
+    def apply_auto_fit(self, result, error):
+        img, self.autofit_img = self.autofit_img, None
+        self.actionAuto_fit.setEnabled(self.img is not None and self.dist_coeff.model == 'standard')
+        if error is not None:
+            self.statusbar.showMessage('Auto-fit failed: {}'.format(error))
+            return
+        if result is None:
+            self.statusbar.showMessage('Auto-fit: no checkerboard or straight lines found')
+            return
+        if img is not self.img or self.dist_coeff.model != 'standard':
+            self.statusbar.showMessage('Auto-fit: the image or model changed, the result is discarded')
+            return
+
+        self.dist_coeff.set_slider_values(*result.slider_values)
+        self.update_distortion_parameters_ui()
+        self.show_image()
+        self.statusbar.showMessage('Auto-fit: {}'.format(result))
+
+    def menu_parameter_sweep(self):
+        if self.img is None:
+            return
+        # Default ranges around the current k1 and k2 values
+        k1, k2 = [int(round(v)) for v in self.dist_coeff.get_slider_values()[:2]]
+        text, ok = QInputDialog.getText(self, 'Parameter sweep', 'Slider ranges (name=start:stop:count)',
+                                        text='k1={}:{}:10, k2={}:{}:10'.format(max(k1 - 100, -500), min(k1 + 100, 500),
+                                                                                max(k2 - 100, -500), min(k2 + 100, 500)))
+        if not ok:
+            return
+        from sweep import run_sweep, parse_sweep
+        try:
+            ranges = parse_sweep([text])
+        except ValueError as e:
+            self.statusbar.showMessage('Invalid sweep: {}'.format(e))
+            return
+        if not ranges:
+            return
+
+        # Thumbnails are rendered and scored on the tool thread
+        self.sweep_ranges = ranges
+        self.actionSweep.setEnabled(False)
+        self.statusbar.showMessage('Sweeping {} candidates'.format(np.prod([len(v) for v in ranges.values()])))
+        self.tool_runner.submit(run_sweep, self.img, copy.copy(self.dist_coeff), ranges, self.focal_length,
+                                done=self.sweep_finished.emit)
+
+    def show_sweep_result(self, result, error):
+        self.actionSweep.setEnabled(self.img is not None)
+        if error is not None:
+            self.statusbar.showMessage('Sweep failed: {}'.format(error))
+            return
+        tiles, sheet = result
+        best = min((tile for tile in tiles if tile.score is not None), key=lambda tile: tile.score, default=None)
+        self.statusbar.showMessage('Sweep: best {}'.format(best) if best is not None else
+                                   'Sweep: no checkerboard or straight lines found, candidates are not scored')
+
+        # The contact sheet fits the screen, clicking a thumbnail applies its coefficients
+        from sweep import get_columns
+        columns = get_columns(self.sweep_ranges, len(tiles))
+        q_img = QImage(sheet.data, sheet.shape[1], sheet.shape[0], sheet.strides[0], QImage.Format.Format_BGR888)
+        pixmap = QPixmap.fromImage(q_img)
+        screen = self.screen().availableGeometry()
+        pixmap = pixmap.scaled(min(pixmap.width(), int(screen.width() * 0.9)),
+                               min(pixmap.height(), int(screen.height() * 0.8)), Qt.AspectRatioMode.KeepAspectRatio,
+                               Qt.TransformationMode.SmoothTransformation)
+
+        if self.sweep_dialog is not None:
+            self.sweep_dialog.close()
+        self.sweep_dialog = QDialog(self)
+        self.sweep_dialog.setWindowTitle('Parameter sweep')
+        label = QLabel(self.sweep_dialog)
+        label.setPixmap(pixmap)
+        label.setAlignment(Qt.AlignmentFlag.AlignLeft | Qt.AlignmentFlag.AlignTop)
+        label.mousePressEvent = partial(self.sweep_mouse_press, tiles, columns, pixmap.width() / sheet.shape[1])
+        layout = QVBoxLayout(self.sweep_dialog)
+        layout.addWidget(label)
+        self.sweep_dialog.show()
+
+    def sweep_mouse_press(self, tiles, columns, scale, event: QMouseEvent):
+        from sweep import CAPTION_HEIGHT
+        tile_height, tile_width = tiles[0].image.shape[:2]
+        column = int(event.position().x() / scale) // tile_width
+        index = int(event.position().y() / scale) // (tile_height + CAPTION_HEIGHT) * columns + column
+        if column < columns and 0 <= index < len(tiles):
+            self.dist_coeff.set_slider_values(*tiles[index].slider_values)
+            self.update_distortion_parameters_ui()
+            self.show_image()
+            self.statusbar.showMessage('Sweep: applied {}'.format(tiles[index]))
+
+    def menu_select_model(self, name):
+        # Slider positions are kept, their steps and the unused sliders follow the model
+        self.dist_coeff.set_model(name)
+        self.update_model_ui()
+        self.update_distortion_parameters_ui()
+        self.show_image()
+
+    def update_model_ui(self):
+        model = self.dist_coeff.get_model()
+        for action, name in zip(self.model_actions.actions(), MODELS):
+            action.setChecked(name == model.name)
+        for slider, step in zip((self.horizontalSlider_k1, self.horizontalSlider_k2, self.horizontalSlider_k3,
+                                 self.horizontalSlider_p1, self.horizontalSlider_p2), model.slider_steps):
+            slider.setEnabled(step is not None)
+        self.actionModel_coefficients.setEnabled(bool(model.extra_names))
+        # Auto-fit estimates the standard model only
+        self.actionAuto_fit.setEnabled(self.img is not None and model.name == 'standard' and self.autofit_img is None)
+
+    def menu_model_coefficients(self):
+        model = self.dist_coeff.get_model()
+        values = self.dist_coeff.get_values()
+        text, ok = QInputDialog.getText(self, 'Model coefficients', '{} coefficients'.format(model.title),
+                                        text=', '.join('{}={}'.format(name, values.get(name, 0.0))
+                                                       for name in model.extra_names))
+        if not ok:
+            return
+        try:
+            extra = parse_extra_coefficients(text)
+        except ValueError as e:
+            self.statusbar.showMessage('Invalid coefficients: {}'.format(e))
+            return
+        self.dist_coeff.extra = {name: value for name, value in extra.items() if name in model.extra_names}
+        self.show_image()
+
     def menu_copy_parameters(self):
         if self.img is not None:
-            pyperclip.copy('k1 = {} / k2 = {} / k3 = {} / p1 = {} / p2 = {}'.format(
-                self.horizontalSlider_k1.value(),
-                self.horizontalSlider_k2.value(),
-                self.horizontalSlider_k3.value(),
-                self.horizontalSlider_p1.value(),
-                self.horizontalSlider_p2.value()))
+            # Linear slider units, exact values typed into the line edits keep their fraction
+            text = 'k1 = {:g} / k2 = {:g} / k3 = {:g} / p1 = {:g} / p2 = {:g}'.format(
+                *self.dist_coeff.get_slider_values())
+            if self.dist_coeff.model != 'standard':
+                text = '{} / model = {} / {}'.format(text, self.dist_coeff.model, ', '.join(
+                    '{}={}'.format(name, value) for name, value in self.dist_coeff.extra.items()))
+            import pyperclip
+            pyperclip.copy(text)
+
+    def closeEvent(self, event):
+        self.stop_stream()
+        self.render_scheduler.shutdown()
+        # Let a running save finish writing its file, a sweep or fit still running is not waited for
+        self.tool_runner.shutdown(wait=False)
+        self.exporter.shutdown(wait=True)
+        super(LDCSimulatorWindow, self).closeEvent(event)
 
-    # FIXME
-    # def resizeEvent(self, event: QResizeEvent):
-    #     self.show_image()
+    def resizeEvent(self, event: QResizeEvent):
+        super(LDCSimulatorWindow, self).resizeEvent(event)
+        if self.label_image.pixmap().isNull():
+            return
+        if self.viewport is not None:
+            # The zoomed view keeps its scale, the re-render fills the new label size
+            self.resize_timer.start()
+            return
+
+        # Fast rescale of the last rendered layer, no un-distortion while the user is dragging
+        lh = self.label_image.height()
+        lw = self.label_image.width()
+        base = self.render_cache.get(self.displayed_key) if self.displayed_key is not None else None
+        if base is not None:
+            pixmap = base.scaled(lw, lh, Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.FastTransformation)
+            self.label_image.setPixmap(self.render_cache.compose(pixmap, self.show_grids, self.grid_division,
+                                                                 self.grid_color))
+        else:
+            self.label_image.setPixmap(self.label_image.pixmap().scaled(lw, lh, Qt.AspectRatioMode.KeepAspectRatio,
+                                                                        Qt.TransformationMode.FastTransformation))
+        self.resize_timer.start()
 
 
 if __name__ == "__main__":
     app = QApplication(sys.argv)
-    window = LDCSimulatorWindow()
+    startup_timer.mark('application')
+    # --startup-time prints the time of every startup stage and exits after the first paint
+    window = LDCSimulatorWindow(startup_timer=startup_timer if '--startup-time' in sys.argv[1:] else None)
     window.show()
     sys.exit(app.exec())
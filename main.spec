@@ -38,3 +38,39 @@ exe = EXE(pyz,
           target_arch=None,
           codesign_identity=None,
           entitlements_file=None )
+
+# Headless command line build, Qt is excluded so batch jobs neither bundle nor load it
+cli_a = Analysis(['C:\\Users\\wangp\\Codes\\GitHub\\LDC_Simulator\\cli.py'],
+             pathex=['C:\\Users\\wangp\\Codes\\GitHub\\LDC_Simulator'],
+             binaries=[],
+             datas=[],
+             hiddenimports=['batch', 'stream', 'tiled', 'autofit', 'sweep', 'service'],
+             hookspath=[],
+             hooksconfig={},
+             runtime_hooks=[],
+             excludes=['PyQt6', 'PyQt5', 'PySide6', 'tkinter'],
+             win_no_prefer_redirects=False,
+             win_private_assemblies=False,
+             cipher=block_cipher,
+             noarchive=False)
+cli_pyz = PYZ(cli_a.pure, cli_a.zipped_data,
+             cipher=block_cipher)
+
+cli_exe = EXE(cli_pyz,
+          cli_a.scripts,
+          cli_a.binaries,
+          cli_a.zipfiles,
+          cli_a.datas,
+          [],
+          name='LDC_Simulator_cli',
+          debug=False,
+          bootloader_ignore_signals=False,
+          strip=False,
+          upx=True,
+          upx_exclude=[],
+          runtime_tmpdir=None,
+          console=True,
+          disable_windowed_traceback=False,
+          target_arch=None,
+          codesign_identity=None,
+          entitlements_file=None )
@@ -0,0 +1,124 @@
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+import numpy as np
+from lens_model import HalfResMaps
+
+# Bumped whenever the stored layout or the map computation changes, old entries are then never hit
+CACHE_VERSION = 2
+
+# Maps smaller than this are cheaper to rebuild than to read back
+MIN_CACHED_PIXELS = 2 * 1000 * 1000
+
+
+def get_default_cache_dir():
+    if os.environ.get('LDC_MAP_CACHE'):
+        return Path(os.environ['LDC_MAP_CACHE'])
+    base = os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache'
+    return Path(base) / 'ldc_simulator' / 'maps'
+
+
+class MapCache:
+    def __init__(self, directory=None, size_limit=4 * 1024 * 1024 * 1024, min_pixels=MIN_CACHED_PIXELS):
+        self.directory = Path(directory) if directory is not None else get_default_cache_dir()
+        # Maximum bytes kept on disk, the least recently used entries are deleted first
+        self.size_limit = size_limit
+        self.min_pixels = min_pixels
+
+    @staticmethod
+    def get_hash(key, map_format):
+        # key is RemapEngine.make_key: (model, camera matrix bytes, coefficient bytes, width, height)
+        digest = hashlib.sha256()
+        digest.update('{}:{}:{}:{}:{}'.format(CACHE_VERSION, key[0], map_format, key[3], key[4]).encode())
+        digest.update(key[1])
+        digest.update(key[2])
+        return digest.hexdigest()
+
+    def get_path(self, key, map_format):
+        # One directory per entry holding the two arrays as .npy files
+        return self.directory / self.get_hash(key, map_format)
+
+    def is_cached_size(self, key):
+        return key[3] * key[4] >= self.min_pixels
+
+    def load(self, key, map_format):
+        if not self.is_cached_size(key):
+            return None
+        directory = self.get_path(key, map_format)
+        if not directory.is_dir():
+            return None
+        try:
+            # Memory-mapped, pages are only read when cv2.remap touches them
+            arrays = [np.load(str(directory / '{}.npy'.format(i)), mmap_mode='r') for i in range(2)]
+            if map_format == 'half' and arrays[0].ndim == 2:
+                scale = int(np.load(str(directory / 'scale.npy')))
+            os.utime(str(directory))
+        except (OSError, ValueError):
+            return None
+        if map_format == 'half' and arrays[0].ndim == 2:
+            # Half format tables that did not fit are stored as CV_16SC2 tables, whose first array has 3 dimensions
+            return HalfResMaps.from_displacements(arrays[0], arrays[1], key[3], key[4], scale=scale)
+        return tuple(arrays)
+
+    def store(self, key, map_format, maps):
+        if not self.is_cached_size(key):
+            return
+        directory = self.get_path(key, map_format)
+        if directory.is_dir():
+            return
+        arrays = (maps.dx, maps.dy) if isinstance(maps, HalfResMaps) else maps
+
+        # Written to a scratch directory and renamed, so concurrent readers and writers never see partial files
+        self.directory.mkdir(parents=True, exist_ok=True)
+        tmp = Path(tempfile.mkdtemp(dir=str(self.directory), prefix='.tmp-'))
+        try:
+            for i, array in enumerate(arrays):
+                np.save(str(tmp / '{}.npy'.format(i)), np.ascontiguousarray(array))
+            if isinstance(maps, HalfResMaps):
+                np.save(str(tmp / 'scale.npy'), np.array(maps.scale))
+            os.replace(str(tmp), str(directory))
+        except OSError:
+            # Another process stored the same maps first, or the disk is full
+            self.remove(tmp)
+            return
+        self.prune()
+
+    def get_entries(self):
+        if not self.directory.is_dir():
+            return []
+        entries = []
+        for directory in self.directory.iterdir():
+            if not directory.is_dir() or directory.name.startswith('.'):
+                continue
+            try:
+                size = sum(f.stat().st_size for f in directory.glob('*.npy'))
+                entries.append((directory.stat().st_mtime, size, directory))
+            except OSError:
+                # Removed by another process meanwhile
+                continue
+        return sorted(entries)
+
+    @staticmethod
+    def remove(directory):
+        try:
+            for f in directory.glob('*'):
+                f.unlink()
+            directory.rmdir()
+        except OSError:
+            # Still memory-mapped on platforms that lock mapped files
+            return False
+        return True
+
+    def prune(self, size_limit=None):
+        size_limit = self.size_limit if size_limit is None else size_limit
+        entries = self.get_entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, directory in entries:
+            if total <= size_limit:
+                break
+            if self.remove(directory):
+                total -= size
+
+    def clear(self):
+        self.prune(0)
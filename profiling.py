@@ -0,0 +1,126 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager, nullcontext
+
+
+class ProfiledFrame:
+    def __init__(self, index):
+        self.index = index
+        self.start = time.perf_counter()
+        self.end = None
+        # (stage name, start, duration, thread id)
+        self.stages = []
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages.append((name, start, time.perf_counter() - start, threading.get_ident()))
+
+    def get_stage_times(self):
+        times = {}
+        for name, _, duration, _ in self.stages:
+            times[name] = times.get(name, 0.0) + duration
+        return times
+
+
+class NullFrame:
+    # Stand-in used while profiling is off, every stage is a no-op
+    index = None
+
+    def stage(self, name):
+        return nullcontext()
+
+
+class FrameProfiler:
+    def __init__(self, capacity=512, enabled=False):
+        self.enabled = enabled
+        self.frames = deque(maxlen=capacity)
+        self.lock = threading.Lock()
+        self.frame_count = 0
+        self.origin = time.perf_counter()
+
+    def begin(self):
+        if not self.enabled:
+            return NullFrame()
+        with self.lock:
+            self.frame_count += 1
+            return ProfiledFrame(self.frame_count)
+
+    def end(self, frame):
+        if isinstance(frame, ProfiledFrame):
+            frame.end = time.perf_counter()
+            with self.lock:
+                self.frames.append(frame)
+
+    def clear(self):
+        with self.lock:
+            self.frames.clear()
+
+    def recent(self, count):
+        with self.lock:
+            return list(self.frames)[-count:]
+
+    def get_fps(self, count=30):
+        frames = self.recent(count)
+        if len(frames) < 2:
+            return 0.0
+        elapsed = frames[-1].end - frames[0].end
+        return (len(frames) - 1) / elapsed if elapsed > 0 else 0.0
+
+    def get_status_text(self, count=30):
+        frames = self.recent(count)
+        if not frames:
+            return 'Profiling: no frames yet'
+
+        # Average of every stage over the recent frames, in pipeline order
+        totals = {}
+        for frame in frames:
+            for name, duration in frame.get_stage_times().items():
+                totals[name] = totals.get(name, 0.0) + duration
+        latency = sum(frame.end - frame.start for frame in frames) / len(frames)
+        return '{:.1f} fps | latency {:.1f} ms | {}'.format(
+            self.get_fps(count), latency * 1000.0,
+            ' | '.join('{} {:.1f} ms'.format(name, total / len(frames) * 1000.0) for name, total in totals.items()))
+
+    def get_trace_events(self):
+        # Chrome trace event format, complete ("X") events in microseconds
+        pid = os.getpid()
+        events = [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': 0, 'args': {'name': 'frames'}}]
+        for frame in self.recent(len(self.frames)):
+            events.append({'name': 'frame {}'.format(frame.index), 'ph': 'X', 'pid': pid, 'tid': 0,
+                           'ts': (frame.start - self.origin) * 1e6, 'dur': (frame.end - frame.start) * 1e6})
+            for name, start, duration, tid in frame.stages:
+                events.append({'name': name, 'ph': 'X', 'pid': pid, 'tid': tid, 'ts': (start - self.origin) * 1e6,
+                               'dur': duration * 1e6, 'args': {'frame': frame.index}})
+        return events
+
+    def dump_trace(self, path):
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': self.get_trace_events(), 'displayTimeUnit': 'ms'}, f)
+
+
+class StartupTimer:
+    def __init__(self):
+        self.start = time.perf_counter()
+        # (stage name, time since the previous mark)
+        self.stages = []
+        self.last = self.start
+
+    def mark(self, name):
+        now = time.perf_counter()
+        self.stages.append((name, now - self.last))
+        self.last = now
+
+    def get_total(self):
+        return self.last - self.start
+
+    def get_report(self):
+        lines = ['{:<16}{:8.1f} ms'.format(name, duration * 1000.0) for name, duration in self.stages]
+        lines.append('{:<16}{:8.1f} ms'.format('total', self.get_total() * 1000.0))
+        return '\n'.join(lines)
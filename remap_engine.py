@@ -0,0 +1,118 @@
+import threading
+from collections import OrderedDict
+import cv2
+import numpy as np
+from lens_model import build_undistort_maps, to_fixed_point, HalfResMaps
+from distortion_models import get_model
+
+# opencv: cv2.initUndistortRectifyMap fixed-point tables, same as cv2.undistort
+# float: CV_32FC1 tables from the vectorized NumPy model
+# fixed: NumPy model converted to CV_16SC2 fixed-point tables
+# half: int16 displacements at half resolution in 1/32 to 1/8 px steps, upsampled bilinearly strip by strip when
+# used. Tables with displacements beyond 4096 px fall back to the opencv tables.
+# The NumPy model covers the standard distortion model, the other models build their float maps with OpenCV
+MAP_FORMATS = ('opencv', 'float', 'fixed', 'half')
+
+
+def get_maps_nbytes(maps):
+    if isinstance(maps, HalfResMaps):
+        return maps.nbytes
+    return sum(m.nbytes for m in maps if m is not None)
+
+
+class RemapEngine:
+    def __init__(self, memory_limit=512 * 1024 * 1024, map_format='opencv', disk_cache=None):
+        if map_format not in MAP_FORMATS:
+            raise ValueError('Unknown map format {}'.format(map_format))
+
+        # Maximum bytes of remap tables kept in the LRU cache
+        self.memory_limit = memory_limit
+        self.map_format = map_format
+        # Optional MapCache, tables missing from memory are looked up on disk before they are built
+        self.disk_cache = disk_cache
+
+        self.maps = OrderedDict()
+        self.memory_usage = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def make_key(camera_matrix, dist_coeff, width, height, model='standard'):
+        camera_matrix = np.ascontiguousarray(camera_matrix, dtype=np.float64)
+        dist_coeff = np.ascontiguousarray(dist_coeff, dtype=np.float64)
+        return model, camera_matrix.tobytes(), dist_coeff.tobytes(), int(width), int(height)
+
+    def get_maps(self, camera_matrix, dist_coeff, width, height, model='standard'):
+        key = self.make_key(camera_matrix, dist_coeff, width, height, model)
+        with self.lock:
+            maps = self.maps.get(key)
+            if maps is not None:
+                self.maps.move_to_end(key)
+                return maps
+
+        # Build the tables outside the lock, OpenCV and NumPy release the GIL here
+        maps = self.disk_cache.load(key, self.map_format) if self.disk_cache is not None else None
+        if maps is None:
+            maps = self.build_maps(camera_matrix, dist_coeff, int(width), int(height), model)
+            if self.disk_cache is not None:
+                self.disk_cache.store(key, self.map_format, maps)
+        self.put_maps(key, maps)
+        return maps
+
+    def build_maps(self, camera_matrix, dist_coeff, width, height, model='standard'):
+        if model != 'standard':
+            model = get_model(model)
+            if self.map_format in ('opencv', 'fixed'):
+                return model.build_maps(camera_matrix, dist_coeff, width, height, map_type=cv2.CV_16SC2)
+            maps = model.build_maps(camera_matrix, dist_coeff, width, height)
+            if self.map_format == 'half':
+                try:
+                    return HalfResMaps(camera_matrix, dist_coeff, width, height, maps=maps)
+                except ValueError:
+                    # Displacements too large for the half format, fixed-point tables like the opencv format
+                    return to_fixed_point(*maps)
+            return maps
+        if self.map_format == 'half':
+            try:
+                return HalfResMaps(camera_matrix, dist_coeff, width, height)
+            except ValueError:
+                pass
+        if self.map_format in ('opencv', 'half'):
+            return cv2.initUndistortRectifyMap(camera_matrix, dist_coeff, None, camera_matrix,
+                                               (width, height), cv2.CV_16SC2)
+        maps = build_undistort_maps(camera_matrix, dist_coeff, width, height)
+        if self.map_format == 'fixed':
+            maps = to_fixed_point(*maps)
+        return maps
+
+    def put_maps(self, key, maps):
+        size = get_maps_nbytes(maps)
+        with self.lock:
+            if key in self.maps:
+                return
+            self.maps[key] = maps
+            self.memory_usage += size
+            self.evict()
+
+    def evict(self):
+        # Drop the least recently used tables, but always keep the newest one
+        while self.memory_usage > self.memory_limit and len(self.maps) > 1:
+            _, maps = self.maps.popitem(last=False)
+            self.memory_usage -= get_maps_nbytes(maps)
+
+    def set_memory_limit(self, memory_limit):
+        with self.lock:
+            self.memory_limit = memory_limit
+            self.evict()
+
+    def clear(self):
+        with self.lock:
+            self.maps.clear()
+            self.memory_usage = 0
+
+    def undistort(self, img: np.ndarray, camera_matrix, dist_coeff, model='standard', interpolation=cv2.INTER_LINEAR,
+                  dst=None):
+        height, width = img.shape[:2]
+        maps = self.get_maps(camera_matrix, dist_coeff, width, height, model)
+        if isinstance(maps, HalfResMaps):
+            return maps.remap(img, interpolation, dst)
+        return cv2.remap(img, maps[0], maps[1], interpolation, dst=dst, borderMode=cv2.BORDER_CONSTANT)
@@ -0,0 +1,62 @@
+from collections import OrderedDict
+from PyQt6.QtGui import QPixmap, QPainter, QPen, QColor
+from PyQt6.QtCore import Qt
+
+
+class RenderCache:
+    def __init__(self, max_entries=8):
+        # Scaled original and undistorted pixmaps, keyed by what was rendered and the label size
+        self.max_entries = max_entries
+        self.pixmaps = OrderedDict()
+
+        # Grid overlay, rebuilt only when its size, division or color changes
+        self.grid_key = None
+        self.grid = None
+
+    def __contains__(self, key):
+        return key in self.pixmaps
+
+    def get(self, key):
+        pixmap = self.pixmaps.get(key)
+        if pixmap is not None:
+            self.pixmaps.move_to_end(key)
+        return pixmap
+
+    def put(self, key, pixmap):
+        self.pixmaps[key] = pixmap
+        self.pixmaps.move_to_end(key)
+        while len(self.pixmaps) > self.max_entries:
+            self.pixmaps.popitem(last=False)
+
+    def clear(self):
+        self.pixmaps.clear()
+
+    def get_grid(self, width, height, division, color: QColor):
+        key = (width, height, division, color.rgb())
+        if key != self.grid_key:
+            grid = QPixmap(width, height)
+            grid.fill(Qt.GlobalColor.transparent)
+
+            # Draw grids
+            painter = QPainter(grid)
+            pen = QPen(color, 1)
+            painter.setPen(pen)
+            for i in range(1, division):
+                painter.drawLine(0, int(i * height / division), width, int(i * height / division))
+                painter.drawLine(int(i * width / division), 0, int(i * width / division), height)
+            painter.end()
+
+            self.grid_key = key
+            self.grid = grid
+        return self.grid
+
+    def compose(self, base: QPixmap, show_grids, division, color: QColor):
+        if not show_grids:
+            return base
+
+        # The copy shares pixel data with the cached layer until the painter detaches it
+        pixmap = QPixmap(base)
+        painter = QPainter(pixmap)
+        painter.drawPixmap(0, 0, self.get_grid(base.width(), base.height(), division, color))
+        painter.end()
+        return pixmap
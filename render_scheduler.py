@@ -0,0 +1,65 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from PyQt6.QtCore import QObject, pyqtSignal
+
+
+class RenderScheduler(QObject):
+    # Emitted from the worker thread, delivered to the UI thread through a queued connection
+    rendered = pyqtSignal(int, object)
+
+    def __init__(self, parent=None):
+        super(RenderScheduler, self).__init__(parent)
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='render')
+        self.lock = threading.Lock()
+
+        # Only the newest request is kept, older pending requests are dropped
+        self.generation = 0
+        self.pending = None
+        self.running = False
+        # Generation of the job being computed
+        self.current = 0
+
+    def submit(self, job):
+        with self.lock:
+            self.generation += 1
+            self.pending = (self.generation, job)
+            if not self.running:
+                self.running = True
+                self.executor.submit(self.run)
+            return self.generation
+
+    def cancel(self):
+        with self.lock:
+            self.generation += 1
+            self.pending = None
+
+    def is_current(self, generation):
+        return generation == self.generation
+
+    def is_stale(self):
+        # True inside a job once a newer request or a cancel came in, long jobs use it to stop early
+        return self.current != self.generation
+
+    def run(self):
+        while True:
+            with self.lock:
+                if self.pending is None:
+                    self.running = False
+                    return
+                generation, job = self.pending
+                self.pending = None
+                self.current = generation
+
+            try:
+                result = job()
+            except Exception as e:
+                print(e)
+                continue
+
+            # Discard the result if a newer request came in while rendering, None is a job that stopped early
+            if result is not None and self.is_current(generation):
+                self.rendered.emit(generation, result)
+
+    def shutdown(self):
+        self.cancel()
+        self.executor.shutdown(wait=False)
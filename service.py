@@ -0,0 +1,286 @@
+import argparse
+import json
+import math
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+import cv2
+import numpy as np
+from distortion import DistortionCoefficients
+from remap_engine import RemapEngine, MAP_FORMATS
+from lens_profile import LensProfile, LensProject
+from batch import add_coefficient_arguments, add_map_cache_argument, parse_coefficients, get_map_cache
+from export import get_encode_param
+
+# Largest request body accepted, an uncompressed 16-bit 100 MP TIFF fits
+MAX_BODY_BYTES = 1024 * 1024 * 1024
+
+# Response image formats by request Content-Type, anything else is answered as PNG
+CONTENT_TYPES = {
+    'image/png': '.png',
+    'image/jpeg': '.jpg',
+    'image/tiff': '.tif',
+    'image/webp': '.webp',
+    'image/bmp': '.bmp',
+}
+
+
+class RequestError(Exception):
+    def __init__(self, message, status=400):
+        super(RequestError, self).__init__(message)
+        self.status = status
+
+
+class UndistortService:
+    def __init__(self, profile, project=None, workers=None, memory_limit=512 * 1024 * 1024, map_format='opencv',
+                 map_cache=None):
+        # Lens profile of requests naming none, and the project whose profiles requests can pick by name
+        self.profile = profile
+        self.project = project
+        # One remap engine for all requests, tables of a lens and image size are built once and stay warm
+        self.remap_engine = RemapEngine(memory_limit, map_format, map_cache)
+        # Connections are served on their own threads, the undistortion itself on a bounded pool
+        self.executor = ThreadPoolExecutor(max_workers=workers or os.cpu_count())
+        self.lock = threading.Lock()
+        self.requests = 0
+
+    def get_profile(self, name=None, data=None):
+        if data is not None:
+            try:
+                return self.check_profile(LensProfile.from_dict(data))
+            except (AttributeError, TypeError, ValueError) as e:
+                raise RequestError('Invalid lens profile: {}'.format(e))
+        if name is not None:
+            try:
+                if self.project is None:
+                    raise KeyError(name)
+                return self.project.get_profile(name)
+            except KeyError:
+                raise RequestError('Unknown lens profile {}'.format(name), 404)
+        return self.profile
+
+    @staticmethod
+    def check_profile(profile):
+        # Profiles sent with a request are only used once their values are numbers in range
+        profile.focal_length = float(profile.focal_length)
+        profile.coefficients = {name: float(value) for name, value in profile.coefficients.items()}
+        size = [int(v) for v in (profile.width, profile.height) if v is not None]
+        if not math.isfinite(profile.focal_length) or profile.focal_length <= 0:
+            raise ValueError('focal_length must be a positive number')
+        if not all(math.isfinite(v) for v in profile.coefficients.values()):
+            raise ValueError('coefficients must be finite numbers')
+        if any(v <= 0 for v in size):
+            raise ValueError('width and height must be positive')
+        if profile.width is not None:
+            profile.width = int(profile.width)
+        if profile.height is not None:
+            profile.height = int(profile.height)
+        return profile
+
+    @staticmethod
+    def get_lens(profile, width, height):
+        dist_coeff = DistortionCoefficients()
+        profile.apply(dist_coeff)
+        camera_matrix = profile.get_camera_matrix(width, height)
+        return dist_coeff.get_model(), camera_matrix, dist_coeff.get_distortion_coefficients()
+
+    def undistort_image(self, data, profile, ext='.png', quality=98):
+        img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+        if img is None:
+            raise RequestError('The request body is not a decodable image')
+        height, width = img.shape[:2]
+        model, camera_matrix, dist_coeff = self.get_lens(profile, width, height)
+        img_undist = self.remap_engine.undistort(img, camera_matrix, dist_coeff, model.name)
+        try:
+            ok, encoded = cv2.imencode(ext, img_undist, get_encode_param(ext, quality))
+        except cv2.error:
+            ok = False
+        if not ok:
+            raise RequestError('Cannot encode the result as {}'.format(ext))
+        return encoded.tobytes()
+
+    def undistort_points(self, points, profile, width, height):
+        try:
+            points = np.asarray(points, dtype=np.float64)
+        except (TypeError, ValueError):
+            raise RequestError('points must be a list of [x, y] pairs')
+        if points.ndim != 2 or points.shape[1] != 2:
+            raise RequestError('points must be a list of [x, y] pairs')
+        if not len(points):
+            return []
+        model, camera_matrix, dist_coeff = self.get_lens(profile, width, height)
+        return model.undistort_points(points, camera_matrix, dist_coeff).tolist()
+
+    def submit(self, fn, *args):
+        with self.lock:
+            self.requests += 1
+        return self.executor.submit(fn, *args).result()
+
+    def get_status(self):
+        with self.lock:
+            requests = self.requests
+        return {'status': 'ok', 'requests': requests, 'cached_maps': len(self.remap_engine.maps),
+                'memory_usage': self.remap_engine.memory_usage, 'profile': self.profile.to_dict(),
+                'profiles': [p.name for p in self.project.profiles] if self.project is not None else []}
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+
+class ServiceRequestHandler(BaseHTTPRequestHandler):
+    # Keep-alive, clients reuse one connection for many requests
+    protocol_version = 'HTTP/1.1'
+
+    @property
+    def service(self):
+        return self.server.service
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super(ServiceRequestHandler, self).log_message(format, *args)
+
+    def send_body(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, data, status=200):
+        self.send_body(status, json.dumps(data).encode(), 'application/json')
+
+    def read_body(self):
+        length = self.headers.get('Content-Length')
+        if length is None:
+            raise RequestError('Content-Length required', 411)
+        try:
+            length = int(length)
+        except ValueError:
+            raise RequestError('Invalid Content-Length {}'.format(length))
+        if length < 0:
+            raise RequestError('Invalid Content-Length {}'.format(length))
+        if length > MAX_BODY_BYTES:
+            raise RequestError('Request body larger than {} bytes'.format(MAX_BODY_BYTES), 413)
+        return self.rfile.read(length)
+
+    def do_GET(self):
+        if urlsplit(self.path).path == '/health':
+            self.send_json(self.service.get_status())
+        else:
+            self.send_json({'error': 'Not found'}, 404)
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        try:
+            data = self.read_body()
+        except RequestError as e:
+            # The unread body would be taken for the next request on this connection
+            self.close_connection = True
+            self.send_json({'error': str(e)}, e.status)
+            return
+        try:
+            if url.path == '/undistort/image':
+                self.post_image(query, data)
+            elif url.path == '/undistort/points':
+                self.post_points(data)
+            else:
+                self.send_json({'error': 'Not found'}, 404)
+        except RequestError as e:
+            self.send_json({'error': str(e)}, e.status)
+        except Exception as e:
+            self.send_json({'error': 'Internal error: {}'.format(e)}, 500)
+
+    def post_image(self, query, data):
+        # Encoded image body, the lens profile by name, as JSON in the X-Lens-Profile header or the server default
+        header = self.headers.get('X-Lens-Profile')
+        try:
+            profile_data = json.loads(header) if header else None
+        except ValueError as e:
+            raise RequestError('Invalid X-Lens-Profile header: {}'.format(e))
+        profile = self.service.get_profile(query.get('profile'), profile_data)
+
+        content_type = (self.headers.get('Content-Type') or '').split(';')[0].strip().lower()
+        ext = query.get('format', CONTENT_TYPES.get(content_type, '.png'))
+        ext = (ext if ext.startswith('.') else '.' + ext).lower()
+        if not cv2.haveImageWriter('image' + ext):
+            raise RequestError('Unsupported response format {}'.format(ext))
+        try:
+            quality = int(query.get('quality', 98))
+        except ValueError:
+            raise RequestError('quality must be an integer')
+        body = self.service.submit(self.service.undistort_image, data, profile, ext, quality)
+        content_type = {v: k for k, v in CONTENT_TYPES.items()}.get(ext, 'application/octet-stream')
+        self.send_body(200, body, content_type)
+
+    def post_points(self, data):
+        # {"points": [[x, y], ...], "width": w, "height": h, "profile": name or profile object}
+        try:
+            request = json.loads(data or b'{}')
+            width, height = int(request['width']), int(request['height'])
+        except (ValueError, KeyError, TypeError) as e:
+            raise RequestError('Expected a JSON object with points, width and height: {}'.format(e))
+        if width <= 0 or height <= 0:
+            raise RequestError('width and height must be positive')
+        profile = request.get('profile')
+        if isinstance(profile, dict):
+            profile = self.service.get_profile(data=profile)
+        else:
+            profile = self.service.get_profile(profile)
+        points = self.service.submit(self.service.undistort_points, request.get('points', []), profile, width,
+                                     height)
+        self.send_json({'points': points})
+
+
+class ServiceServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, service, verbose=False):
+        super(ServiceServer, self).__init__(address, ServiceRequestHandler)
+        self.service = service
+        self.verbose = verbose
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Local HTTP service applying a lens profile to images and points')
+    add_coefficient_arguments(parser)
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on, loopback only by default')
+    parser.add_argument('--port', type=int, default=8765, help='port to listen on, 0 picks a free one')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--memory-limit', type=int, default=512, help='remap cache size in MB')
+    parser.add_argument('--map-format', choices=MAP_FORMATS, default='opencv', help='remap table format')
+    add_map_cache_argument(parser)
+    parser.add_argument('--verbose', action='store_true', help='log every request')
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    dist_coeff = parse_coefficients(args, parser)
+    # With --profile the whole project is served, its profiles can be picked by name in each request
+    project = LensProject.load(args.profile) if args.profile else None
+    if project is not None:
+        profile = project.get_profile(args.profile_name)
+    else:
+        profile = LensProfile.from_coefficients(dist_coeff, args.focal_length, name='default')
+
+    service = UndistortService(profile, project, args.workers, args.memory_limit * 1024 * 1024, args.map_format,
+                               get_map_cache(args.map_cache))
+    server = ServiceServer((args.host, args.port), service, args.verbose)
+    print('Serving {} on http://{}:{}'.format(profile, *server.server_address[:2]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.shutdown()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,46 @@
+import math
+
+# Slider positions run from -SLIDER_RANGE to SLIDER_RANGE
+SLIDER_RANGE = 500
+
+SCALES = ('linear', 'log')
+
+# Decades covered by the logarithmic scale, the first position is 1/1000 of a linear unit
+LOG_DECADES = 3.0
+
+# In fine mode the whole slider covers this many linear units around the value it was centered on
+FINE_SPAN = 25.0
+
+
+def format_coefficient(value):
+    return '{:.6g}'.format(value)
+
+
+class SliderScale:
+    def __init__(self, scale='linear', fine=False):
+        if scale not in SCALES:
+            raise ValueError('Unknown slider scale {}'.format(scale))
+        # Slider units are coefficient / step, the units of "Copy parameters" and --sliders
+        self.scale = scale
+        self.fine = fine
+
+    def to_units(self, position, center=0.0):
+        if self.fine:
+            return center + position * FINE_SPAN / SLIDER_RANGE
+        if self.scale == 'log':
+            # Fine steps around zero, coarse ones towards the ends, both ends stay at +-SLIDER_RANGE units
+            x = abs(position) / SLIDER_RANGE
+            units = SLIDER_RANGE * (10.0 ** (LOG_DECADES * x) - 1.0) / (10.0 ** LOG_DECADES - 1.0)
+            return math.copysign(units, position)
+        return float(position)
+
+    def to_position(self, units, center=0.0):
+        if self.fine:
+            position = (units - center) * SLIDER_RANGE / FINE_SPAN
+        elif self.scale == 'log':
+            x = math.log10(1.0 + abs(units) / SLIDER_RANGE * (10.0 ** LOG_DECADES - 1.0)) / LOG_DECADES
+            position = math.copysign(x * SLIDER_RANGE, units)
+        else:
+            position = units
+        # Exact values typed beyond the slider range park the slider at its end
+        return int(round(min(max(position, -SLIDER_RANGE), SLIDER_RANGE)))
@@ -0,0 +1,347 @@
+import argparse
+import glob
+import queue
+import sys
+import threading
+import time
+from pathlib import Path
+import cv2
+import numpy as np
+from distortion_models import get_model
+from remap_engine import RemapEngine
+from batch import add_coefficient_arguments, add_map_cache_argument, parse_coefficients, get_map_cache, get_lens_profile
+from export import get_encode_param
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv', '.m4v', '.wmv')
+
+# Marks the end of the stream between pipeline stages
+END_OF_STREAM = None
+
+
+class VideoSource:
+    def __init__(self, path):
+        # A bare integer opens a camera device
+        self.capture = cv2.VideoCapture(int(path) if str(path).isdigit() else str(path))
+        if not self.capture.isOpened():
+            raise IOError('Cannot open video {}'.format(path))
+        self.fps = self.capture.get(cv2.CAP_PROP_FPS) or 30.0
+
+    def read(self):
+        ok, frame = self.capture.read()
+        return frame if ok else None
+
+    def close(self):
+        self.capture.release()
+
+
+class ImageSequenceSource:
+    def __init__(self, pattern, fps=30.0):
+        if Path(pattern).is_dir():
+            pattern = str(Path(pattern) / '*')
+        self.files = iter(sorted(glob.glob(pattern)))
+        self.fps = fps
+
+    def read(self):
+        for filename in self.files:
+            frame = cv2.imdecode(np.fromfile(filename, dtype=np.uint8), cv2.IMREAD_COLOR)
+            if frame is not None:
+                return frame
+        return None
+
+    def close(self):
+        pass
+
+
+class VideoSink:
+    def __init__(self, path, fps):
+        self.path = str(path)
+        self.fps = fps
+        self.writer = None
+
+    def write(self, frame):
+        if self.writer is None:
+            # The writer is opened lazily, the frame size is only known once the first frame arrives
+            height, width = frame.shape[:2]
+            fourcc = cv2.VideoWriter_fourcc(*('XVID' if self.path.lower().endswith('.avi') else 'mp4v'))
+            self.writer = cv2.VideoWriter(self.path, fourcc, self.fps, (width, height))
+        self.writer.write(frame)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.release()
+
+
+class ImageSequenceSink:
+    def __init__(self, output_dir, ext='.png', quality=98):
+        self.output_dir = Path(output_dir)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.ext = ext if ext.startswith('.') else '.' + ext
+        self.encode_param = get_encode_param(self.ext, quality)
+        self.index = 0
+
+    def write(self, frame):
+        path = self.output_dir / 'frame_{:06d}{}'.format(self.index, self.ext)
+        ok, encoded = cv2.imencode(self.ext, frame, self.encode_param)
+        if not ok:
+            raise IOError('Cannot encode frame {} as {}'.format(self.index, self.ext))
+        encoded.tofile(str(path))
+        self.index += 1
+
+    def close(self):
+        pass
+
+
+class CallbackSink:
+    def __init__(self, callback, fps=None):
+        self.callback = callback
+        # Pace the frames at the source frame rate for live previews
+        self.interval = 1.0 / fps if fps else 0.0
+        self.next_time = None
+
+    def write(self, frame):
+        # Returns the time spent waiting so it is not counted as encode time
+        idle = 0.0
+        if self.interval:
+            now = time.perf_counter()
+            if self.next_time is not None and self.next_time > now:
+                idle = self.next_time - now
+                time.sleep(idle)
+            self.next_time = max(now, self.next_time or now) + self.interval
+        self.callback(frame)
+        return idle
+
+    def close(self):
+        pass
+
+
+def open_source(path, fps=30.0):
+    if Path(path).suffix.lower() in VIDEO_EXTENSIONS or str(path).isdigit():
+        return VideoSource(path)
+    return ImageSequenceSource(path, fps)
+
+
+def open_sink(path, fps, ext='.png', quality=98):
+    if Path(path).suffix.lower() in VIDEO_EXTENSIONS:
+        return VideoSink(path, fps)
+    return ImageSequenceSink(path, ext, quality)
+
+
+class StageStats:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.last = 0.0
+
+    def add(self, elapsed):
+        self.count += 1
+        self.total += elapsed
+        self.last = elapsed
+
+    def average_ms(self):
+        return self.total / self.count * 1000.0 if self.count else 0.0
+
+
+class StreamPipeline:
+    STAGES = ('decode', 'remap', 'encode')
+
+    def __init__(self, source, sink, dist_coeff, focal_length=10.0, queue_size=4, preview_size=None,
+                 remap_engine=None, model='standard', profile=None):
+        self.source = source
+        self.sink = sink
+        # Model and coefficients are swapped as one tuple, so a frame never mixes the two
+        self.lens = (get_model(model), dist_coeff)
+        self.focal_length = focal_length
+        # Lens profile with the sensor size its focal length is in pixels of, frames of other sizes scale it
+        self.profile = profile
+        # (width, height) to fit frames into before remapping, used for live previews
+        self.preview_size = preview_size
+        self.remap_engine = remap_engine if remap_engine is not None else RemapEngine()
+
+        # Bounded queues keep the memory flat however long the clip is
+        self.decoded = queue.Queue(maxsize=queue_size)
+        self.remapped = queue.Queue(maxsize=queue_size)
+
+        self.stats = {stage: StageStats() for stage in self.STAGES}
+        self.frames = 0
+        self.start_time = None
+        self.end_time = None
+        self.stop_event = threading.Event()
+        self.threads = []
+        # First exception raised in a stage, raised again by wait()
+        self.error = None
+
+    def set_coefficients(self, dist_coeff, model='standard'):
+        # Takes effect from the next frame
+        self.lens = (get_model(model), dist_coeff)
+
+    def put(self, q, item):
+        while not self.stop_event.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def get(self, q):
+        while not self.stop_event.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return END_OF_STREAM
+
+    def fit_preview(self, frame):
+        height, width = frame.shape[:2]
+        scale = min(self.preview_size[0] / width, self.preview_size[1] / height, 1.0)
+        if scale < 1.0:
+            frame = cv2.resize(frame, (max(1, int(round(width * scale))), max(1, int(round(height * scale)))),
+                               interpolation=cv2.INTER_AREA)
+        return frame, frame.shape[1] / width
+
+    def decode_stage(self):
+        stats = self.stats['decode']
+        while not self.stop_event.is_set():
+            t = time.perf_counter()
+            frame = self.source.read()
+            if frame is None:
+                break
+            scale = 1.0
+            if self.preview_size is not None:
+                frame, scale = self.fit_preview(frame)
+            stats.add(time.perf_counter() - t)
+            if not self.put(self.decoded, (frame, scale)):
+                break
+        self.put(self.decoded, END_OF_STREAM)
+
+    def remap_stage(self):
+        stats = self.stats['remap']
+        while True:
+            item = self.get(self.decoded)
+            if item is END_OF_STREAM:
+                break
+            frame, scale = item
+            t = time.perf_counter()
+            height, width = frame.shape[:2]
+            model, dist_coeff = self.lens
+            if self.profile is not None:
+                camera_matrix = model.get_camera_matrix(width, height,
+                                                        self.profile.get_focal_length(width / scale), scale)
+            else:
+                camera_matrix = model.get_camera_matrix(width, height, self.focal_length, scale)
+            frame = self.remap_engine.undistort(frame, camera_matrix, dist_coeff, model.name)
+            stats.add(time.perf_counter() - t)
+            if not self.put(self.remapped, frame):
+                break
+        self.put(self.remapped, END_OF_STREAM)
+
+    def encode_stage(self):
+        stats = self.stats['encode']
+        while True:
+            frame = self.get(self.remapped)
+            if frame is END_OF_STREAM:
+                break
+            t = time.perf_counter()
+            idle = self.sink.write(frame) or 0.0
+            stats.add(time.perf_counter() - t - idle)
+            self.frames += 1
+        self.end_time = time.perf_counter()
+
+    def run_stage(self, stage):
+        # A failing stage stops the others, they would wait forever on its queue otherwise
+        try:
+            stage()
+        except Exception as e:
+            if self.error is None:
+                self.error = e
+            self.stop_event.set()
+
+    def start(self):
+        self.start_time = time.perf_counter()
+        for stage in (self.decode_stage, self.remap_stage, self.encode_stage):
+            thread = threading.Thread(target=self.run_stage, args=(stage,), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def wait(self):
+        for thread in self.threads:
+            thread.join()
+        try:
+            self.source.close()
+        finally:
+            self.sink.close()
+        if self.error is not None:
+            raise self.error
+
+    def run(self):
+        self.start()
+        self.wait()
+        return self.get_report()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def is_running(self):
+        return any(thread.is_alive() for thread in self.threads)
+
+    def get_fps(self):
+        if self.start_time is None:
+            return 0.0
+        elapsed = (self.end_time or time.perf_counter()) - self.start_time
+        return self.frames / elapsed if elapsed > 0 else 0.0
+
+    def get_report(self):
+        report = {'frames': self.frames, 'fps': self.get_fps()}
+        for stage in self.STAGES:
+            report['{}_ms'.format(stage)] = self.stats[stage].average_ms()
+        return report
+
+    def get_status_text(self):
+        return '{:.1f} fps | decode {:.1f} ms | remap {:.1f} ms | encode {:.1f} ms'.format(
+            self.get_fps(), *(self.stats[stage].average_ms() for stage in self.STAGES))
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Streaming lens distortion correction for videos and image sequences')
+    parser.add_argument('input', help='video file, camera index, image directory or glob')
+    parser.add_argument('output', help='output video file (.mp4/.avi/...) or image sequence directory')
+    add_coefficient_arguments(parser)
+    parser.add_argument('--fps', type=float, default=30.0, help='frame rate of image sequence inputs')
+    parser.add_argument('--ext', default='.png', help='frame format of image sequence outputs')
+    parser.add_argument('--quality', type=int, default=98, help='JPEG/WebP quality')
+    parser.add_argument('--queue-size', type=int, default=4, help='frames buffered between stages')
+    add_map_cache_argument(parser)
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    dist_coeff = parse_coefficients(args, parser)
+    ext = args.ext if args.ext.startswith('.') else '.' + args.ext
+    if Path(args.output).suffix.lower() not in VIDEO_EXTENSIONS and not cv2.haveImageWriter('frame' + ext):
+        parser.error('Cannot write {} images'.format(ext))
+    print(dist_coeff)
+
+    source = open_source(args.input, args.fps)
+    sink = open_sink(args.output, source.fps, args.ext, args.quality)
+    pipeline = StreamPipeline(source, sink, dist_coeff.get_distortion_coefficients(), args.focal_length,
+                              args.queue_size, remap_engine=RemapEngine(disk_cache=get_map_cache(args.map_cache)),
+                              model=dist_coeff.model, profile=get_lens_profile(args, dist_coeff))
+    try:
+        report = pipeline.run()
+    except KeyboardInterrupt:
+        pipeline.stop()
+        pipeline.wait()
+        report = pipeline.get_report()
+    except Exception as e:
+        print('Stream failed after {} frames: {}'.format(pipeline.frames, e), file=sys.stderr)
+        return 1
+
+    print('{} frames, {}'.format(report['frames'], pipeline.get_status_text()))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,210 @@
+import argparse
+import copy
+import itertools
+import os
+import sys
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+from autofit import PARAMETERS, detect_checkerboard, detect_lines, stack_groups, straightness_residuals
+from batch import add_coefficient_arguments, parse_coefficients, get_lens_profile
+from tiled import open_image, write_image
+
+# Height of the caption strip under every thumbnail
+CAPTION_HEIGHT = 34
+
+# Share of the straightest lines that is averaged into a candidate's score
+SCORE_LINE_FRACTION = 0.75
+
+
+def parse_range(text):
+    # "start:stop:count" in slider units with both ends included, a single value is a fixed setting
+    parts = [float(v) for v in text.split(':')]
+    if len(parts) == 1:
+        return [int(round(parts[0]))]
+    if len(parts) != 3 or parts[2] < 1:
+        raise ValueError('Sweep range must be start:stop:count, got {}'.format(text))
+    return [int(round(v)) for v in np.linspace(parts[0], parts[1], int(parts[2]))]
+
+
+def parse_sweep(items):
+    # ["k1=-300:0:10", "k2=-100:100:10"] to an ordered {name: slider values}
+    ranges = OrderedDict()
+    for item in items:
+        for part in item.replace(' ', ',').split(','):
+            if not part:
+                continue
+            name, _, text = part.partition('=')
+            name = name.strip().lower()
+            if name not in PARAMETERS:
+                raise ValueError('Unknown sweep parameter {}'.format(name))
+            ranges[name] = parse_range(text)
+    return ranges
+
+
+def get_candidates(base_values, ranges):
+    # Every combination of the swept values, the last parameter varies fastest
+    names = list(ranges)
+    candidates = []
+    for combination in itertools.product(*(ranges[name] for name in names)):
+        values = dict(zip(PARAMETERS, base_values))
+        values.update(zip(names, combination))
+        candidates.append(tuple(values[name] for name in PARAMETERS))
+    return candidates
+
+
+class SweepTile:
+    def __init__(self, slider_values, image, score):
+        self.slider_values = slider_values
+        self.image = image
+        # RMS distance of the detected lines from straight, relative to the line lengths (x1000), lower is better
+        self.score = score
+
+    def get_caption(self, names=PARAMETERS):
+        values = dict(zip(PARAMETERS, self.slider_values))
+        return ' '.join('{}={:g}'.format(name, values[name]) for name in names)
+
+    def __str__(self):
+        score = '-' if self.score is None else '{:.3f}'.format(self.score)
+        return '{} score {}'.format(self.get_caption(), score)
+
+
+class ParameterSweep:
+    def __init__(self, img, dist_coeff, focal_length=10.0, tile_width=320, max_size=800, workers=None):
+        # Work shared by all tiles: one downsampled copy of the image and one line detection
+        self.dist_coeff = dist_coeff
+        self.model = dist_coeff.get_model()
+        self.focal_length = focal_length
+        self.workers = workers or os.cpu_count()
+
+        height, width = img.shape[:2]
+        scale = min(max_size / max(width, height), 1.0)
+        small = np.asarray(img)
+        if scale < 1.0:
+            small = cv2.resize(small, (max(1, int(round(width * scale))), max(1, int(round(height * scale)))),
+                               interpolation=cv2.INTER_AREA)
+        if small.ndim == 2:
+            small = cv2.cvtColor(small, cv2.COLOR_GRAY2BGR)
+
+        # Lines are detected once in the distorted image, each candidate only undistorts their points
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        self.detect_height, self.detect_width = gray.shape[:2]
+        self.detect_scale = self.detect_width / width
+        groups = detect_checkerboard(gray) or detect_lines(gray)
+        self.points, self.labels = stack_groups(groups) if groups else (None, None)
+
+        tile_scale = min(tile_width / width, 1.0)
+        self.tile_width = max(1, int(round(width * tile_scale)))
+        self.tile_height = max(1, int(round(height * tile_scale)))
+        self.tile_scale = self.tile_width / width
+        self.thumbnail = cv2.resize(small, (self.tile_width, self.tile_height), interpolation=cv2.INTER_AREA)
+
+    def get_coefficients(self, slider_values):
+        dist_coeff = copy.copy(self.dist_coeff)
+        dist_coeff.set_slider_values(*slider_values)
+        return dist_coeff.get_distortion_coefficients()
+
+    def score(self, dist_coeff):
+        if self.points is None:
+            return None
+        camera_matrix = self.model.get_camera_matrix(self.detect_width, self.detect_height, self.focal_length,
+                                                     self.detect_scale)
+        distances = straightness_residuals(self.points, self.labels, camera_matrix, dist_coeff, None,
+                                           model=self.model)
+        # Mean over the straightest three quarters of the lines, so curved objects and clutter picked up as
+        # lines do not decide the ranking
+        line_rms = np.sort(np.sqrt(np.bincount(self.labels, distances ** 2) / np.bincount(self.labels)))
+        return float(np.mean(line_rms[:max(1, int(len(line_rms) * SCORE_LINE_FRACTION))])) * 1000.0
+
+    def render_tile(self, slider_values):
+        dist_coeff = self.get_coefficients(slider_values)
+        camera_matrix = self.model.get_camera_matrix(self.tile_width, self.tile_height, self.focal_length,
+                                                     self.tile_scale)
+        map1, map2 = self.model.build_maps(camera_matrix, dist_coeff, self.tile_width, self.tile_height,
+                                           map_type=cv2.CV_16SC2)
+        image = cv2.remap(self.thumbnail, map1, map2, cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT)
+        return SweepTile(slider_values, image, self.score(dist_coeff))
+
+    def run(self, candidates):
+        # Thumbnail sized maps are cheap, tiles are rendered and scored in parallel
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            return list(executor.map(self.render_tile, candidates))
+
+
+def get_best(tiles):
+    scored = [tile for tile in tiles if tile.score is not None]
+    return min(scored, key=lambda tile: tile.score) if scored else None
+
+
+def make_contact_sheet(tiles, columns, names=PARAMETERS):
+    # Thumbnails in a grid, captioned with the swept values and the score, the best tile is framed in green
+    tile_height, tile_width = tiles[0].image.shape[:2]
+    rows = (len(tiles) + columns - 1) // columns
+    cell_height = tile_height + CAPTION_HEIGHT
+    sheet = np.zeros((rows * cell_height, columns * tile_width, 3), dtype=np.uint8)
+    best = get_best(tiles)
+
+    for i, tile in enumerate(tiles):
+        x = (i % columns) * tile_width
+        y = (i // columns) * cell_height
+        sheet[y:y + tile_height, x:x + tile_width] = tile.image
+        cv2.putText(sheet, tile.get_caption(names), (x + 4, y + tile_height + 14), cv2.FONT_HERSHEY_SIMPLEX, 0.4,
+                    (255, 255, 255), 1, cv2.LINE_AA)
+        if tile.score is not None:
+            cv2.putText(sheet, 'score {:.3f}'.format(tile.score), (x + 4, y + tile_height + 29),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.4, (200, 200, 200), 1, cv2.LINE_AA)
+        if tile is best:
+            cv2.rectangle(sheet, (x + 1, y + 1), (x + tile_width - 2, y + cell_height - 2), (0, 255, 0), 2)
+    return sheet
+
+
+def get_columns(ranges, count):
+    # Two or more swept parameters give one column per value of the last one, a single one a square-ish grid
+    if len(ranges) >= 2:
+        return len(list(ranges.values())[-1])
+    return max(1, int(np.ceil(np.sqrt(count))))
+
+
+def run_sweep(img, dist_coeff, ranges, focal_length=10.0, tile_width=320, workers=None):
+    base_values = dist_coeff.get_slider_values()
+    candidates = get_candidates(base_values, ranges)
+    tiles = ParameterSweep(img, dist_coeff, focal_length, tile_width, workers=workers).run(candidates)
+    sheet = make_contact_sheet(tiles, get_columns(ranges, len(tiles)), list(ranges) or PARAMETERS)
+    return tiles, sheet
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Contact sheet of undistorted thumbnails over coefficient ranges')
+    parser.add_argument('input', help='input image, .npy inputs are memory-mapped')
+    parser.add_argument('output', help='contact sheet image')
+    parser.add_argument('--sweep', action='append', required=True,
+                        help='slider range, e.g. k1=-300:0:10, repeat or comma separate for more parameters')
+    add_coefficient_arguments(parser)
+    parser.add_argument('--tile-width', type=int, default=320)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--top', type=int, default=5, help='number of best candidates to print')
+    args = parser.parse_args(argv)
+
+    dist_coeff = parse_coefficients(args, parser)
+    ranges = parse_sweep(args.sweep)
+    img = open_image(args.input)
+
+    start = time.perf_counter()
+    focal_length = get_lens_profile(args, dist_coeff).get_focal_length(img.shape[1])
+    tiles, sheet = run_sweep(img, dist_coeff, ranges, focal_length, args.tile_width, args.workers)
+    elapsed = time.perf_counter() - start
+    write_image(args.output, sheet)
+
+    print('{} candidates in {:.2f} s'.format(len(tiles), elapsed))
+    ranked = sorted((tile for tile in tiles if tile.score is not None), key=lambda tile: tile.score)
+    if not ranked:
+        print('No checkerboard or straight lines found, candidates are not scored')
+    for tile in ranked[:args.top]:
+        print(tile)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,124 @@
+import http.client
+import json
+import os
+import sys
+import threading
+import unittest
+
+# Run from anywhere against the simulator modules in the parent directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cv2
+import numpy as np
+from distortion import DistortionCoefficients
+from lens_profile import LensProfile
+from service import UndistortService, ServiceServer
+
+# Moderate barrel correction, slider values k1, k2, k3, p1, p2
+SLIDER_VALUES = (-100, -20, 0, 10, -10)
+
+
+class ServiceRoundTripTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        dist_coeff = DistortionCoefficients()
+        dist_coeff.set_slider_values(*SLIDER_VALUES)
+        cls.profile = LensProfile.from_coefficients(dist_coeff, 10.0, name='default')
+        cls.service = UndistortService(cls.profile, workers=2)
+        # Port 0 picks a free port, the server runs on a daemon thread for the whole test class
+        cls.server = ServiceServer(('127.0.0.1', 0), cls.service)
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+
+        rng = np.random.default_rng(0)
+        cls.img = rng.integers(0, 256, (120, 160, 3), dtype=np.uint8)
+        cls.png = cv2.imencode('.png', cls.img)[1].tobytes()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        cls.service.shutdown()
+
+    def request(self, method, path, body=None, headers=None):
+        # A new connection each time, error responses may close it
+        connection = http.client.HTTPConnection(*self.server.server_address[:2], timeout=10)
+        try:
+            connection.putrequest(method, path)
+            for name, value in (headers or {}).items():
+                connection.putheader(name, value)
+            connection.endheaders(body)
+            response = connection.getresponse()
+            return response.status, response.getheader('Content-Type'), response.read()
+        finally:
+            connection.close()
+
+    def post(self, path, body, headers=None):
+        headers = dict(headers or {})
+        headers.setdefault('Content-Length', str(len(body)))
+        return self.request('POST', path, body, headers)
+
+    def assert_error(self, result, status):
+        self.assertEqual(result[0], status)
+        self.assertIn('error', json.loads(result[2]))
+
+    def test_health(self):
+        status, _, body = self.request('GET', '/health')
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(body)['status'], 'ok')
+
+    def test_undistort_image(self):
+        status, content_type, body = self.post('/undistort/image', self.png, {'Content-Type': 'image/png'})
+        self.assertEqual(status, 200)
+        self.assertEqual(content_type, 'image/png')
+        result = cv2.imdecode(np.frombuffer(body, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+
+        model, camera_matrix, dist_coeff = self.service.get_lens(self.profile, 160, 120)
+        expected = cv2.undistort(self.img, camera_matrix, dist_coeff)
+        self.assertEqual(result.shape, self.img.shape)
+        self.assertLessEqual(np.abs(result.astype(int) - expected.astype(int)).mean(), 1.0)
+
+    def test_undistort_image_format(self):
+        status, content_type, body = self.post('/undistort/image?format=jpg', self.png)
+        self.assertEqual(status, 200)
+        self.assertEqual(content_type, 'image/jpeg')
+        self.assertEqual(cv2.imdecode(np.frombuffer(body, dtype=np.uint8), cv2.IMREAD_COLOR).shape, self.img.shape)
+
+    def test_undistort_points(self):
+        points = [[0.0, 0.0], [80.0, 60.0], [150.5, 10.25]]
+        request = json.dumps({'points': points, 'width': 160, 'height': 120}).encode()
+        status, _, body = self.post('/undistort/points', request)
+        self.assertEqual(status, 200)
+
+        model, camera_matrix, dist_coeff = self.service.get_lens(self.profile, 160, 120)
+        expected = cv2.undistortPoints(np.array(points).reshape(-1, 1, 2), camera_matrix, dist_coeff,
+                                       P=camera_matrix).reshape(-1, 2)
+        np.testing.assert_allclose(json.loads(body)['points'], expected, atol=1e-3)
+
+    def test_invalid_content_length(self):
+        self.assert_error(self.post('/undistort/image', self.png, {'Content-Length': 'abc'}), 400)
+        self.assert_error(self.post('/undistort/image', b'', {'Content-Length': '-1'}), 400)
+        self.assert_error(self.request('POST', '/undistort/points'), 411)
+
+    def test_invalid_format(self):
+        self.assert_error(self.post('/undistort/image?format=xyz', self.png), 400)
+
+    def test_invalid_profile_header(self):
+        profile = dict(self.profile.to_dict(), width='wide', height=120)
+        self.assert_error(self.post('/undistort/image', self.png, {'X-Lens-Profile': json.dumps(profile)}), 400)
+        self.assert_error(self.post('/undistort/image', self.png, {'X-Lens-Profile': '{'}), 400)
+        self.assert_error(self.post('/undistort/image?profile=missing', self.png), 404)
+
+    def test_invalid_image_and_points(self):
+        self.assert_error(self.post('/undistort/image', b'not an image'), 400)
+        self.assert_error(self.post('/undistort/points', b'[1, 2]'), 400)
+        request = json.dumps({'points': [['x', 1]], 'width': 160, 'height': 120}).encode()
+        self.assert_error(self.post('/undistort/points', request), 400)
+
+    def test_unknown_path(self):
+        self.assert_error(self.post('/undistort/video', b''), 404)
+        self.assert_error(self.request('GET', '/missing'), 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,147 @@
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from pathlib import Path
+import cv2
+import numpy as np
+from distortion_models import get_model
+from batch import add_coefficient_arguments, parse_coefficients, get_lens_profile
+from export import get_encode_param
+
+
+def open_image(path):
+    # .npy files are memory-mapped so only the pages a tile needs are read, other formats must be decoded whole
+    if Path(path).suffix.lower() == '.npy':
+        return np.load(str(path), mmap_mode='r')
+    img = cv2.imdecode(np.fromfile(str(path), dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+    if img is None:
+        raise IOError('Cannot read {}'.format(path))
+    return img
+
+
+def iter_tiles(width, height, tile_size):
+    for y in range(0, height, tile_size):
+        for x in range(0, width, tile_size):
+            yield x, y, min(tile_size, width - x), min(tile_size, height - y)
+
+
+class TiledUndistorter:
+    def __init__(self, camera_matrix, dist_coeff, tile_size=1024, workers=None, interpolation=cv2.INTER_LINEAR,
+                 model='standard'):
+        self.camera_matrix = camera_matrix
+        self.dist_coeff = dist_coeff
+        self.model = get_model(model)
+        self.tile_size = tile_size
+        self.workers = workers or os.cpu_count()
+        self.interpolation = interpolation
+
+        self.tiles_done = 0
+        self.tiles_total = 0
+        self.lock = threading.Lock()
+
+    def get_source_rect(self, map_x, map_y, width, height):
+        # Bounding box of the source pixels the tile samples, with one pixel margin for interpolation
+        x0 = max(int(np.floor(map_x.min())) - 1, 0)
+        y0 = max(int(np.floor(map_y.min())) - 1, 0)
+        x1 = min(int(np.ceil(map_x.max())) + 2, width)
+        y1 = min(int(np.ceil(map_y.max())) + 2, height)
+        return x0, y0, x1, y1
+
+    def undistort_tile(self, src, dst, rect):
+        height, width = src.shape[:2]
+        x, y, w, h = rect
+        map_x, map_y = self.model.build_maps(self.camera_matrix, self.dist_coeff, width, height, rect)
+
+        x0, y0, x1, y1 = self.get_source_rect(map_x, map_y, width, height)
+        if x1 <= x0 or y1 <= y0:
+            # The whole tile maps outside the source image
+            dst[y:y + h, x:x + w] = 0
+        else:
+            map_x -= x0
+            map_y -= y0
+            region = np.ascontiguousarray(src[y0:y1, x0:x1])
+            dst[y:y + h, x:x + w] = cv2.remap(region, map_x, map_y, self.interpolation,
+                                              borderMode=cv2.BORDER_CONSTANT)
+
+        with self.lock:
+            self.tiles_done += 1
+
+    def undistort(self, src, dst):
+        height, width = src.shape[:2]
+        tiles = list(iter_tiles(width, height, self.tile_size))
+        self.tiles_done = 0
+        self.tiles_total = len(tiles)
+
+        # At most two tiles per worker are in flight, so peak memory depends on the tile size only
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            pending = set()
+            for rect in tiles:
+                if len(pending) >= 2 * self.workers:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        future.result()
+                pending.add(executor.submit(self.undistort_tile, src, dst, rect))
+            for future in pending:
+                future.result()
+        return dst
+
+
+def undistort_to_memmap(src, camera_matrix, dist_coeff, path, tile_size=1024, workers=None, model='standard'):
+    # The output is written straight into a memory-mapped .npy file
+    dst = np.lib.format.open_memmap(str(path), mode='w+', dtype=src.dtype, shape=src.shape)
+    TiledUndistorter(camera_matrix, dist_coeff, tile_size, workers, model=model).undistort(src, dst)
+    dst.flush()
+    return dst
+
+
+def write_image(path, img, quality=98):
+    ext = Path(path).suffix.lower()
+    cv2.imencode(ext, img, get_encode_param(ext, quality))[1].tofile(str(path))
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Tiled, memory-mapped lens distortion correction for huge images')
+    parser.add_argument('input', help='input image, .npy inputs are memory-mapped')
+    parser.add_argument('output', help='output image, .npy outputs are written tile by tile without encoding')
+    add_coefficient_arguments(parser)
+    parser.add_argument('--tile-size', type=int, default=1024)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--quality', type=int, default=98, help='JPEG/WebP quality')
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    dist_coeff = parse_coefficients(args, parser)
+    print(dist_coeff)
+
+    src = open_image(args.input)
+    height, width = src.shape[:2]
+    camera_matrix = get_lens_profile(args, dist_coeff).get_camera_matrix(width, height)
+
+    start = time.perf_counter()
+    if Path(args.output).suffix.lower() == '.npy':
+        undistort_to_memmap(src, camera_matrix, dist_coeff.get_distortion_coefficients(), args.output,
+                            args.tile_size, args.workers, dist_coeff.model)
+    else:
+        # Encoders need the whole image, keep it in a memory-mapped scratch file rather than in RAM
+        with tempfile.TemporaryDirectory() as tmp:
+            dst = undistort_to_memmap(src, camera_matrix, dist_coeff.get_distortion_coefficients(),
+                                      Path(tmp) / 'undistorted.npy', args.tile_size, args.workers,
+                                      dist_coeff.model)
+            write_image(args.output, dst, args.quality)
+            del dst
+    elapsed = time.perf_counter() - start
+
+    print('{}x{} in {:.2f} s ({:.1f} MP/s)'.format(width, height, elapsed, width * height / 1e6 / elapsed))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
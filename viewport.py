@@ -0,0 +1,173 @@
+import math
+import threading
+from collections import OrderedDict
+import cv2
+import numpy as np
+from distortion_models import get_model
+
+# Output tiles are this many pixels square at the zoom they are rendered at
+TILE_SIZE = 256
+
+# Zoom levels are powers of ZOOM_STEP, tiles rendered at a level are found again after zooming back to it
+ZOOM_STEP = 2 ** 0.5
+MAX_ZOOM_LEVEL = 8  # 16x
+
+# Downscaled copies of the source kept for the zoom levels below 1:1
+MAX_SOURCE_LEVELS = 3
+
+
+def get_zoom(level):
+    return ZOOM_STEP ** level
+
+
+def get_fit_level(zoom):
+    # Lowest zoom level that magnifies beyond the whole image fitted to the view
+    return int(math.floor(math.log(zoom, ZOOM_STEP))) + 1
+
+
+class Viewport:
+    def __init__(self, width, height, level=0, center=None):
+        # Image size, zoom level and the view center, both in full resolution output pixels
+        self.width = width
+        self.height = height
+        self.level = min(level, MAX_ZOOM_LEVEL)
+        self.center = center if center is not None else (width / 2.0, height / 2.0)
+
+    @property
+    def zoom(self):
+        return get_zoom(self.level)
+
+    def get_output_size(self):
+        # Size of the whole undistorted image at this zoom
+        return max(1, int(round(self.width * self.zoom))), max(1, int(round(self.height * self.zoom)))
+
+    def get_origin(self, view_width, view_height):
+        # Top left corner of the view in zoomed output pixels, negative when the image is smaller than the view
+        origin = []
+        for center, size, view_size in zip(self.center, self.get_output_size(), (view_width, view_height)):
+            if size <= view_size:
+                origin.append((size - view_size) // 2)
+            else:
+                origin.append(min(max(int(round(center * self.zoom - view_size / 2.0)), 0), size - view_size))
+        return tuple(origin)
+
+    def clamp(self, view_width, view_height):
+        # Keeps the view inside the image, so panning back starts moving at once
+        x, y = self.get_origin(view_width, view_height)
+        self.center = ((x + view_width / 2.0) / self.zoom, (y + view_height / 2.0) / self.zoom)
+
+    def to_image(self, x, y, view_width, view_height):
+        # Full resolution output position of a view position
+        origin_x, origin_y = self.get_origin(view_width, view_height)
+        return (origin_x + x) / self.zoom, (origin_y + y) / self.zoom
+
+    def zoom_at(self, level, x, y, view_width, view_height):
+        # The image point under the view position (x, y) stays where it is
+        image_x, image_y = self.to_image(x, y, view_width, view_height)
+        self.level = min(level, MAX_ZOOM_LEVEL)
+        self.center = (image_x - (x - view_width / 2.0) / self.zoom, image_y - (y - view_height / 2.0) / self.zoom)
+        self.clamp(view_width, view_height)
+
+    def pan(self, dx, dy, view_width, view_height):
+        # Moves the image by (dx, dy) view pixels
+        self.center = (self.center[0] - dx / self.zoom, self.center[1] - dy / self.zoom)
+        self.clamp(view_width, view_height)
+
+
+class ViewportRenderer:
+    def __init__(self, memory_limit=256 * 1024 * 1024):
+        # Undistorted tiles of the views shown so far, least recently used ones are dropped first
+        self.memory_limit = memory_limit
+        self.memory_usage = 0
+        self.tiles = OrderedDict()
+        self.sources = OrderedDict()
+        self.img = None
+        self.lock = threading.Lock()
+
+    def set_image(self, img):
+        with self.lock:
+            self.img = img
+            self.sources.clear()
+            self.tiles.clear()
+            self.memory_usage = 0
+
+    def get_source(self, img, level):
+        # Zoomed out views sample an area averaged copy of the source, zoomed in ones the source itself
+        if level >= 0:
+            return img
+        with self.lock:
+            source = self.sources.get(level) if img is self.img else None
+            if source is not None:
+                self.sources.move_to_end(level)
+                return source
+        height, width = img.shape[:2]
+        zoom = get_zoom(level)
+        source = cv2.resize(img, (max(1, int(round(width * zoom))), max(1, int(round(height * zoom)))),
+                            interpolation=cv2.INTER_AREA)
+        with self.lock:
+            if img is self.img:
+                self.sources[level] = source
+                while len(self.sources) > MAX_SOURCE_LEVELS:
+                    self.sources.popitem(last=False)
+        return source
+
+    def get_tile(self, img, viewport, model, dist_coeff, focal_length, interpolation, tx, ty):
+        # Tiles are of the image the render started with, set_image() in between keeps them out of the cache
+        key = (model, dist_coeff.tobytes(), focal_length, interpolation, viewport.level, tx, ty)
+        with self.lock:
+            tile = self.tiles.get(key) if img is self.img else None
+            if tile is not None:
+                self.tiles.move_to_end(key)
+                return tile
+
+        # Maps of the tile's output rect only, the camera of the source is zoomed to the output level
+        source = self.get_source(img, viewport.level)
+        model = get_model(model)
+        source_height, source_width = source.shape[:2]
+        camera_matrix = model.get_camera_matrix(source_width, source_height, focal_length,
+                                                source_width / viewport.width)
+        output_width, output_height = viewport.get_output_size()
+        x, y = tx * TILE_SIZE, ty * TILE_SIZE
+        rect = (x, y, min(TILE_SIZE, output_width - x), min(TILE_SIZE, output_height - y))
+        zoom = max(viewport.zoom, 1.0)
+        # Fixed-point tables resolve 1/32 pixel, magnified views need the float positions
+        map1, map2 = model.build_maps(camera_matrix, dist_coeff, source_width, source_height, rect,
+                                      cv2.CV_16SC2 if zoom == 1.0 else cv2.CV_32FC1, zoom)
+        tile = cv2.remap(source, map1, map2, interpolation, borderMode=cv2.BORDER_CONSTANT)
+
+        with self.lock:
+            if img is self.img and key not in self.tiles:
+                self.tiles[key] = tile
+                self.memory_usage += tile.nbytes
+                while self.memory_usage > self.memory_limit and len(self.tiles) > 1:
+                    _, old = self.tiles.popitem(last=False)
+                    self.memory_usage -= old.nbytes
+        return tile
+
+    def render(self, viewport, view_width, view_height, model, dist_coeff, focal_length,
+               interpolation=cv2.INTER_LINEAR, dst=None):
+        # The view is pasted together from the tiles it overlaps, only tiles not seen before are undistorted
+        img = self.img
+        shape = (view_height, view_width) + img.shape[2:]
+        view = dst if dst is not None and dst.shape == shape and dst.dtype == img.dtype else np.empty(shape, img.dtype)
+        view[...] = 0
+        dist_coeff = np.ascontiguousarray(dist_coeff, dtype=np.float64)
+        origin_x, origin_y = viewport.get_origin(view_width, view_height)
+        output_width, output_height = viewport.get_output_size()
+
+        x0, y0 = max(origin_x, 0), max(origin_y, 0)
+        x1, y1 = min(origin_x + view_width, output_width), min(origin_y + view_height, output_height)
+        for ty in range(y0 // TILE_SIZE, (y1 - 1) // TILE_SIZE + 1):
+            for tx in range(x0 // TILE_SIZE, (x1 - 1) // TILE_SIZE + 1):
+                tile = self.get_tile(img, viewport, model, dist_coeff, focal_length, interpolation, tx, ty)
+                # Part of the tile inside the view, in output pixels
+                left, top = max(tx * TILE_SIZE, x0), max(ty * TILE_SIZE, y0)
+                right, bottom = min(tx * TILE_SIZE + tile.shape[1], x1), min(ty * TILE_SIZE + tile.shape[0], y1)
+                view[top - origin_y:bottom - origin_y, left - origin_x:right - origin_x] = \
+                    tile[top - ty * TILE_SIZE:bottom - ty * TILE_SIZE, left - tx * TILE_SIZE:right - tx * TILE_SIZE]
+        return view
+
+    def clear(self):
+        with self.lock:
+            self.tiles.clear()
+            self.memory_usage = 0